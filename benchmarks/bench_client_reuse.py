@@ -0,0 +1,57 @@
+"""
+Benchmark: fresh OpenAI() per call vs. the shared pooled client from gpt_common.client.
+
+Runs the same number of chat completions against the local mock server and reports
+wall-clock time and how many TCP connections the server accepted.
+
+Usage:
+    python bench_client_reuse.py [--requests 200] [--concurrency 8]
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from openai import OpenAI
+
+from gpt_common.client import configure_client_pool, get_client
+from mock_llm_server import MockLLMServer
+
+MESSAGES = [{"role": "user", "content": "Clean this academic text:\n\nLorem ipsum dolor sit amet."}]
+
+
+def run(server, make_client, n_requests, concurrency):
+    server.connections = 0
+    server.requests = 0
+
+    def call(_):
+        make_client().chat.completions.create(model="gpt-4o-mini", messages=MESSAGES)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, range(n_requests)))
+    return time.perf_counter() - start, server.connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark OpenAI client reuse')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    with MockLLMServer() as server:
+        os.environ['OPENAI_BASE_URL'] = server.base_url
+        os.environ.setdefault('OPENAI_API_KEY', 'mock')
+        configure_client_pool(args.concurrency)
+
+        for name, make_client in [("new client per call", OpenAI), ("shared client", get_client)]:
+            elapsed, connections = run(server, make_client, args.requests, args.concurrency)
+            print(f"{name:>20}: {elapsed:.2f}s, {connections} TCP connections for {args.requests} requests")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark: '//continue' rounds that resend the whole conversation vs. independent
+continuation requests (source slice + anchor) in add_doxygen.
+
+A mock model documents every declaration of a large synthetic class but can only return
+a limited number of lines per response, so long chunks need several rounds. The mock
+server counts the input sent; its latency grows with the prompt and answer size.
+
+Usage:
+    python bench_continuation.py [--members 100 200 400] [--output-lines 120]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'doc_writer'))
+
+from gpt_common.cache import configure_cache
+from gpt_common.chat import chat_completion
+from mock_llm_server import MockLLMServer
+import add_doxygen
+
+CODE_MARKER = "Add Doxygen documentation to the following C++ code: \n"
+
+# The continuation prompt of the conversation loop
+LEGACY_CONTINUE_PROMPT = "Please continue adding doxygen documentation from the previous response. \
+            Please only include the documented code in your response, without any explanation. \
+            If you cannot finish the task in one response, you should return the code with doxygen documentation added so far \
+            and add '//continue' as the last line of your response."
+
+SECONDS_PER_INPUT_TOKEN = 20e-6
+SECONDS_PER_OUTPUT_TOKEN = 2e-3
+
+
+def synthetic_class(members):
+    lines = ["class Mesh {", "public:"]
+    for i in range(members):
+        lines.append(f"    int compute_value_{i}(const std::vector<double>& weights, int index) const;")
+    lines.append("};")
+    return '\n'.join(lines) + '\n'
+
+
+def document(code_lines):
+    """What the mock model returns for the full code: a comment before every declaration."""
+    doc_lines = []
+    for line in code_lines:
+        if line.rstrip().endswith(';') and '(' in line:
+            doc_lines.append(line[:len(line) - len(line.lstrip())] + "/// Documented.")
+        doc_lines.append(line)
+    return doc_lines
+
+
+class DoxygenMockServer(MockLLMServer):
+    """Documents the last code it was sent, at most output_lines lines per response."""
+
+    def __init__(self, output_lines):
+        super().__init__()
+        self.output_lines = output_lines
+
+    def reply(self, messages):
+        # The code comes from the last user message that carries code; in a conversation,
+        # the lines returned by the assistant since then are already done
+        code_index = max(i for i, m in enumerate(messages) if m['role'] == 'user' and CODE_MARKER in m['content'])
+        code = messages[code_index]['content'].split(CODE_MARKER)[-1]
+        done = sum(len(m['content'].replace('//continue', '').strip('\n').split('\n'))
+                   for m in messages[code_index:] if m['role'] == 'assistant')
+        doc_lines = document(code.split('\n'))
+        content = '\n'.join(doc_lines[done:done + self.output_lines])
+        if done + self.output_lines < len(doc_lines):
+            content += '\n//continue'
+        prompt_chars = sum(len(m['content']) for m in messages)
+        time.sleep(prompt_chars / 4 * SECONDS_PER_INPUT_TOKEN + len(content) / 4 * SECONDS_PER_OUTPUT_TOKEN)
+        return content
+
+
+def legacy_add_doxygen_chunk(code_chunk):
+    """The conversation loop: every round resends all earlier responses."""
+    chat_history = add_doxygen.multi_chat_history(code_chunk)
+    response_list = []
+    while not response_list or ('//continue' in response_list[-1]
+                                and len(response_list) <= add_doxygen.MAX_CONTINUE_ITER):
+        if response_list:
+            chat_history.append({"role": "user", "content": LEGACY_CONTINUE_PROMPT})
+        result = chat_completion(model=add_doxygen.MODEL, messages=chat_history, max_tokens=4095)
+        response_list.append(result.content)
+        chat_history.append({"role": "assistant", "content": result.content})
+    return add_doxygen.merge_multi_responses(response_list)
+
+
+def run(server, document_chunk, code):
+    server.requests = 0
+    server.input_chars = 0
+    start = time.perf_counter()
+    doc_code = document_chunk(code)
+    elapsed = time.perf_counter() - start
+    correct = [line for line in doc_code.split('\n') if line.strip()] == \
+              [line for line in document(code.split('\n')) if line.strip()]
+    return elapsed, server.requests, server.input_chars // 4, correct
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark continuation strategies of add_doxygen')
+    parser.add_argument('--members', type=int, nargs='+', default=[100, 200, 400])
+    parser.add_argument('--output-lines', type=int, default=120, help='lines the mock model returns per response')
+    args = parser.parse_args()
+
+    configure_cache(enabled=False)
+    add_doxygen.MAX_CONTINUE_ITER = 100  # let both strategies finish long chunks
+    with DoxygenMockServer(args.output_lines) as server:
+        os.environ['OPENAI_BASE_URL'] = server.base_url
+        os.environ.setdefault('OPENAI_API_KEY', 'mock')
+        for members in args.members:
+            code = synthetic_class(members)
+            print(f"class with {members} members:")
+            for name, document_chunk in [("conversation", legacy_add_doxygen_chunk),
+                                         ("continuation requests", add_doxygen.add_doxygen_chunk)]:
+                elapsed, requests, input_tokens, correct = run(server, document_chunk, code)
+                print(f"  {name:>22}: {elapsed:6.2f}s, {requests:3d} requests, {input_tokens:7d} input tokens"
+                      f"{'' if correct else ', WRONG OUTPUT'}")
+
+
+if __name__ == '__main__':
+    main()
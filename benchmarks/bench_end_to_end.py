@@ -0,0 +1,281 @@
+"""
+End-to-end benchmark of pdf_text_cleaner (full answers and --edits), pdf_pipeline and add_doxygen
+(full answers, --patch, and --undocumented on mostly documented headers) against the local mock server.
+
+Synthetic inputs (a paper as extracted text with ligatures left on half of the pages, the
+same paper as a PDF, directories of undocumented and of mostly documented C++ headers) are generated from fixed seeds, and every tool runs as its own process against
+a MockLLMServer with the configured latency, output speed, cut-offs and rate limits.
+For each run the wall-clock time, API calls, 429s, tokens and peak memory (max RSS of
+the tool's process) are reported.
+
+Save the results with --json and pass them back as --baseline on a later run to catch
+regressions: the benchmark exits with status 1 if a run got slower, used more memory or
+made more calls or tokens than the baseline allows.
+
+Usage:
+    python bench_end_to_end.py [--pages 40] [--headers 20] [--concurrency 4] [--latency 0.2]
+                               [--tokens-per-second 500] [--rate-limit-every 0] [--length-every 0]
+                               [--documented-share 0.8] [--json results.json] [--baseline results.json]
+                               [--tolerance 0.15]
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from mock_llm_server import MockLLMServer
+from synthetic_pdf import page_lines, write_pdf
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+CLEAN_MARKER = "Clean this academic text:\n\n"
+CODE_MARKER = "Add Doxygen documentation to the following C++ code: \n"
+EDITS_MARKER = "List the edits cleaning this academic text:\n\n"
+PATCH_MARKER = "Write Doxygen comments for the following C++ code: \n"
+UNDOCUMENTED_RE = re.compile(r"Write Doxygen comments for the declarations on lines ([\d, ]+) of .*?: \n", re.S)
+DOC_COMMENT = "/** @brief Documented. */"
+DECLARATION_RE = re.compile(r'[;{]\s*$')
+
+# Counts must not grow against the baseline; timings and memory may grow by --tolerance
+EXACT_METRICS = ('api_calls', 'input_tokens', 'output_tokens')
+NOISY_METRICS = ('wall_seconds', 'peak_rss_mb')
+
+
+def is_declaration(line):
+    return bool(DECLARATION_RE.search(line)) and not line.lstrip().startswith(('}', '#', 'public', 'private'))
+
+
+def comment_targets(lines):
+    """Indices of the lines above which the undocumented declarations get their comment (their template line)."""
+    targets = []
+    for k, line in enumerate(lines):
+        if not is_declaration(line):
+            continue
+        start = k
+        while start > 0 and lines[start - 1].lstrip().startswith('template'):
+            start -= 1
+        if not (start > 0 and lines[start - 1].strip() == DOC_COMMENT):
+            targets.append(start)
+    return targets
+
+
+def insert_comments(lines, targets):
+    doc_lines = []
+    targets = set(targets)
+    for k, line in enumerate(lines):
+        if k in targets:
+            doc_lines.append(line[:len(line) - len(line.lstrip())] + DOC_COMMENT)
+        doc_lines.append(line)
+    return doc_lines
+
+
+class BenchmarkServer(MockLLMServer):
+    """Mock server whose answers look like the tools' real output (and so have realistic sizes)."""
+
+    def reply(self, messages):
+        user = [m['content'] for m in messages if m.get('role') == 'user'][-1]
+        if CODE_MARKER in user:
+            # Document every declaration
+            lines = user.split(CODE_MARKER)[-1].split('\n')
+            return '\n'.join(insert_comments(lines, comment_targets(lines)))
+        if PATCH_MARKER in user:
+            # The same comments, as insertion patches for the numbered lines
+            line_ids, lines = zip(*(numbered.split('|', 1)
+                                    for numbered in user.split(PATCH_MARKER, 1)[1].split('\n')))
+            return json.dumps({'comments': [{'line': int(line_ids[k]), 'comment': DOC_COMMENT}
+                                            for k in comment_targets(lines)]})
+        match = UNDOCUMENTED_RE.search(user)
+        if match:
+            # Comments for the requested lines only
+            return json.dumps({'comments': [{'line': int(line_id), 'comment': DOC_COMMENT}
+                                            for line_id in match.group(1).split(',')]})
+        if EDITS_MARKER in user:
+            # The same cleaning, as edits of the numbered lines
+            edits = []
+            for numbered in user.split(EDITS_MARKER, 1)[1].split('\n'):
+                line_id, line = numbered.split('|', 1)
+                if line.strip().isdigit():
+                    edits.append({'from': int(line_id), 'to': int(line_id), 'text': ''})
+                elif re.match(r'^\d+ ', line):
+                    edits.append({'from': int(line_id), 'to': int(line_id), 'text': re.sub(r'^\d+ ', '', line)})
+            return json.dumps({'edits': edits})
+        if CLEAN_MARKER in user:
+            # Drop margin line numbers and page numbers
+            text = user.split(CLEAN_MARKER, 1)[1]
+            lines = [re.sub(r'^\d+ ', '', line) for line in text.split('\n') if not line.strip().isdigit()]
+            return '\n'.join(lines)
+        return user
+
+
+def synthetic_paper(path, pages, seed=0, dirty_every=2):
+    """Write the paper as extracted text; every dirty_every-th page has ligature glyphs left in it."""
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        for page_num in range(pages):
+            text = '\n'.join(page_lines(page_num, 45, rng)) + '\n'
+            if dirty_every and page_num % dirty_every == 0:
+                text = text.replace('figure', '\ufb01gure')
+            f.write(text)
+
+
+def synthetic_headers(directory, n_headers, seed=0, documented_share=0.0):
+    """Write the headers; a documented_share of their declarations already has a Doxygen comment."""
+    rng = random.Random(seed)
+    for h in range(n_headers):
+        lines = ["#pragma once", "#include <vector>", ""]
+        for c in range(rng.randint(1, 3)):
+            lines += [f"enum class Mode{h}_{c} {{ Fast, Exact }};", "",
+                      f"class Solver{h}_{c} {{", "public:"]
+            for m in range(rng.randint(5, 40)):
+                lines.append(f"    double step_{m}(const std::vector<double>& x, int iterations = {m});")
+            lines += ["private:", "    int size_;", "};", ""]
+        for f in range(rng.randint(1, 5)):
+            lines += [f"int helper_{h}_{f}(int a, int b);", ""]
+        lines += ["template <typename T>", f"T clamp_{h}(T value, T low, T high);", ""]
+        if documented_share:
+            doc_rng = random.Random(seed * 1000 + h)
+            lines = insert_comments(lines, [k for k in comment_targets(lines) if doc_rng.random() < documented_share])
+        with open(os.path.join(directory, f"solver_{h}.h"), 'w') as out:
+            out.write('\n'.join(lines))
+
+
+def run_tool(server, name, args):
+    """Run a tool in its own process; returns its measurements."""
+    server.reset_counters()
+    env = dict(os.environ, OPENAI_BASE_URL=server.base_url, OPENAI_API_KEY='mock')
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable] + args, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.stdout.read()
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        sys.stdout.write(output.decode('utf-8', 'replace'))
+        raise RuntimeError(f"{name} exited with status {process.returncode}")
+    return {
+        'wall_seconds': round(elapsed, 3),
+        'api_calls': server.requests,
+        'rate_limited': server.rate_limited,
+        'input_tokens': server.prompt_tokens,
+        'output_tokens': server.completion_tokens,
+        'peak_rss_mb': round(rusage.ru_maxrss / 1024, 1),  # ru_maxrss is in KiB on Linux
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        for metric in EXACT_METRICS + NOISY_METRICS:
+            old = baseline.get(name, {}).get(metric)
+            if old is None:
+                continue
+            allowed = old if metric in EXACT_METRICS else old * (1 + tolerance)
+            if result[metric] > allowed:
+                regressions.append(f"{name}: {metric} {old} -> {result[metric]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark against a mock LLM server')
+    parser.add_argument('--pages', type=int, default=40, help='pages of the synthetic paper')
+    parser.add_argument('--headers', type=int, default=20, help='number of synthetic headers')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--max-chunk-tokens', type=int, default=3000)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds before the first token')
+    parser.add_argument('--tokens-per-second', type=float, default=500, help='mock output speed')
+    parser.add_argument('--max-output-tokens', type=int, default=None)
+    parser.add_argument('--length-every', type=int, default=0, help='cut off one answer in N')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='answer every Nth request with a 429')
+    parser.add_argument('--retry-after', type=float, default=0.5)
+    parser.add_argument('--documented-share', type=float, default=0.8,
+                        help='share of the declarations already documented in the headers of the doxygen-mature '
+                             'and doxygen-undoc runs')
+    parser.add_argument('--only', nargs='+', choices=['clean', 'clean-edits', 'pipeline', 'doxygen', 'doxygen-patch',
+                                                      'doxygen-mature', 'doxygen-undoc'],
+                        default=None)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='relative increase of time and memory tolerated against the baseline')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            BenchmarkServer(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                            max_output_tokens=args.max_output_tokens, length_every=args.length_every,
+                            rate_limit_every=args.rate_limit_every, retry_after=args.retry_after) as server:
+        paper_txt = os.path.join(tmp, 'paper.txt')
+        paper_pdf = os.path.join(tmp, 'paper.pdf')
+        headers = os.path.join(tmp, 'headers')
+        mature_headers = os.path.join(tmp, 'mature_headers')
+        os.makedirs(headers)
+        os.makedirs(mature_headers)
+        synthetic_paper(paper_txt, args.pages)
+        write_pdf(paper_pdf, args.pages)
+        synthetic_headers(headers, args.headers)
+        synthetic_headers(mature_headers, args.headers, documented_share=args.documented_share)
+
+        common = ['--no-cache', '--max-chunk-tokens', str(args.max_chunk_tokens)]
+        runs = {
+            'clean': [os.path.join(ROOT, 'pdf_cleaner', 'pdf_text_cleaner.py'), paper_txt,
+                      os.path.join(tmp, 'paper_clean.txt'), '--concurrency', str(args.concurrency)] + common,
+            'clean-edits': [os.path.join(ROOT, 'pdf_cleaner', 'pdf_text_cleaner.py'), paper_txt,
+                            os.path.join(tmp, 'paper_edits.txt'), '--concurrency', str(args.concurrency),
+                            '--edits'] + common,
+            # The synthetic PDF has no artifacts left after pre-cleaning, so every chunk is sent
+            'pipeline': [os.path.join(ROOT, 'pdf_cleaner', 'pdf_pipeline.py'), paper_pdf,
+                         os.path.join(tmp, 'paper_pipeline.txt'), '--concurrency', str(args.concurrency),
+                         '--clean-all'] + common,
+            'doxygen': [os.path.join(ROOT, 'doc_writer', 'add_doxygen.py'), headers,
+                        '-o', os.path.join(tmp, 'headers_doxygen'), '-j', str(args.concurrency), '--no-cache'],
+            'doxygen-patch': [os.path.join(ROOT, 'doc_writer', 'add_doxygen.py'), headers,
+                              '-o', os.path.join(tmp, 'headers_patch'), '-j', str(args.concurrency), '--no-cache',
+                              '--patch'],
+            # A mostly documented code base, in full and with only the undocumented declarations sent
+            'doxygen-mature': [os.path.join(ROOT, 'doc_writer', 'add_doxygen.py'), mature_headers,
+                               '-o', os.path.join(tmp, 'mature_doxygen'), '-j', str(args.concurrency), '--no-cache'],
+            'doxygen-undoc': [os.path.join(ROOT, 'doc_writer', 'add_doxygen.py'), mature_headers,
+                              '-o', os.path.join(tmp, 'mature_undoc'), '-j', str(args.concurrency), '--no-cache',
+                              '--undocumented'],
+        }
+        results = {}
+        print(f"{'run':>14} {'wall':>8} {'calls':>6} {'429s':>5} {'input tok':>10} {'output tok':>10} {'peak RSS':>9}")
+        for name, tool_args in runs.items():
+            if args.only and name not in args.only:
+                continue
+            results[name] = r = run_tool(server, name, tool_args)
+            print(f"{name:>14} {r['wall_seconds']:7.2f}s {r['api_calls']:6d} {r['rate_limited']:5d} "
+                  f"{r['input_tokens']:10d} {r['output_tokens']:10d} {r['peak_rss_mb']:7.1f}MB")
+
+        if 'doxygen-undoc' in results:
+            # A second pass over its own output must find nothing left to document
+            recheck = run_tool(server, 'doxygen-undoc', [
+                os.path.join(ROOT, 'doc_writer', 'add_doxygen.py'), os.path.join(tmp, 'mature_undoc'),
+                '-o', os.path.join(tmp, 'mature_recheck'), '--no-cache', '--undocumented'])
+            if recheck['api_calls']:
+                print(f"ERROR a second --undocumented pass made {recheck['api_calls']} calls")
+                sys.exit(1)
+            print("A second --undocumented pass found nothing left to document")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark: peak memory and time of pdf_to_txt extraction, before (all pages joined in
+memory) and after (page-by-page streaming, optionally with worker processes) on a large
+synthetic PDF.
+
+Each variant runs in a fresh subprocess so its peak RSS is measured in isolation.
+
+Usage:
+    python bench_pdf_extract.py [--pages 2000] [--pdf existing.pdf] [--workers 4]
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'pdf_cleaner'))
+
+from synthetic_pdf import write_pdf
+
+
+def legacy_extract(filename, outfile):
+    """extractPdfText as it was before streaming."""
+    import PyPDF2
+    with open(filename, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        page_texts = [page.extract_text() for page in reader.pages]
+        full_text = "\n".join(page_texts)
+    with open(outfile, 'w') as file:
+        file.write(full_text)
+
+
+def run_variant(variant, pdf_path, out_path, workers):
+    """Run one variant in this process and print elapsed time and peak RSS."""
+    from pdf_to_txt import extractPdfText
+    start = time.perf_counter()
+    if variant == 'legacy':
+        legacy_extract(pdf_path, out_path)
+    else:
+        extractPdfText(pdf_path, out_path, workers)
+    elapsed = time.perf_counter() - start
+    # kilobytes on Linux; worker processes are reported separately
+    peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    print(f"{elapsed:.3f} {peak_kb}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark PDF text extraction memory')
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--pdf', help='benchmark this PDF instead of a synthetic one')
+    parser.add_argument('--workers', type=int, default=1, help='also benchmark extraction with this many processes')
+    parser.add_argument('--run', choices=['legacy', 'streaming', 'parallel'], help=argparse.SUPPRESS)
+    parser.add_argument('--out', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_variant(args.run, args.pdf, args.out, args.workers if args.run == 'parallel' else 1)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = args.pdf or os.path.join(tmp_dir, 'synthetic.pdf')
+        if not args.pdf:
+            write_pdf(pdf_path, args.pages)
+        print(f"{pdf_path}: {os.path.getsize(pdf_path) / 1e6:.1f} MB")
+        outputs = {}
+        variants = ['legacy', 'streaming'] + (['parallel'] if args.workers > 1 else [])
+        for variant in variants:
+            out_path = os.path.join(tmp_dir, f'{variant}.txt')
+            result = subprocess.run([sys.executable, __file__, '--run', variant, '--pdf', pdf_path, '--out', out_path,
+                                     '--workers', str(args.workers)],
+                                    check=True, capture_output=True, text=True)
+            elapsed, peak_kb = result.stdout.split()[-2:]
+            print(f"{variant:>10}: {float(elapsed):.2f}s, peak RSS {int(peak_kb) / 1024:.0f} MB")
+            with open(out_path, 'rb') as f:
+                outputs[variant] = f.read()
+        print("outputs identical:", all(output == outputs['legacy'] for output in outputs.values()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark: legacy split_text_by_tokens (re-encodes every trimmed chunk) vs. the
+single-encode splitter in pdf_text_cleaner.
+
+Usage:
+    python bench_split.py [--sizes 100000 500000 2000000] [--max-chunk-tokens 10000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'pdf_cleaner'))
+
+import tiktoken
+
+from pdf_text_cleaner import split_text_by_tokens, token_byte_lengths
+
+WORDS = ("the of and to in we is that for on with as by this are be an mesh surface energy "
+         "optimization method results figure table equation vertex triangle convergence").split()
+
+
+def legacy_split_text_by_tokens(text, max_tokens=10000, model="gpt-4o-mini"):
+    """The splitter as it was before the single-pass rewrite."""
+    encoding = tiktoken.encoding_for_model(model)
+    tokens = encoding.encode(text)
+    chunks = []
+    sentence_breaks = [".", "!", "?", ";", ":"]
+    current_pos = 0
+    while current_pos < len(tokens):
+        chunk_tokens = tokens[current_pos:current_pos + max_tokens]
+        chunk_text = encoding.decode(chunk_tokens)
+        if current_pos + max_tokens >= len(tokens):
+            chunks.append(chunk_text)
+            break
+        last_break_pos = -1
+        for break_token in sentence_breaks:
+            pos = chunk_text.rfind(break_token)
+            if pos > last_break_pos:
+                last_break_pos = pos
+        if last_break_pos != -1:
+            chunk_text = chunk_text[:last_break_pos + 1]
+            current_pos += len(encoding.encode(chunk_text))
+        else:
+            current_pos += len(chunk_tokens)
+        chunks.append(chunk_text)
+    return chunks
+
+
+def synthetic_text(n_chars, seed=0):
+    """Paper-like text: sentences of random words, with paragraph breaks."""
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    while size < n_chars:
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 30))).capitalize()
+        sentence += rng.choice(['. ', '. ', '. ', '; ', '.\n\n'])
+        parts.append(sentence)
+        size += len(sentence)
+    return ''.join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark text splitting')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 500_000, 2_000_000],
+                        help='input sizes in characters')
+    parser.add_argument('--max-chunk-tokens', type=int, default=10000)
+    parser.add_argument('--model', default='gpt-4o-mini')
+    args = parser.parse_args()
+
+    token_byte_lengths(args.model)  # load the encoder and its token table outside the timed region
+    for size in args.sizes:
+        text = synthetic_text(size)
+        for name, split in [("legacy", legacy_split_text_by_tokens), ("single-pass", split_text_by_tokens)]:
+            start = time.perf_counter()
+            chunks = split(text, args.max_chunk_tokens, args.model)
+            elapsed = time.perf_counter() - start
+            print(f"{size:>10} chars  {name:>11}: {elapsed:.3f}s, {len(chunks)} chunks")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""
+Local stand-in for the OpenAI chat-completions endpoint, used by the benchmarks.
+
+The server answers POST {base_url}/chat/completions by echoing the last user message
+and counts the TCP connections and requests it receives, so client behaviour can be
+measured without an API key or network access. It also stands in for the Files and
+Batch endpoints: an uploaded batch file is run through the same chat-completions
+handler in a background thread, and its output file can be downloaded when done.
+Requests with "stream": true are answered with server-sent chunk events.
+
+Everything is deterministic and configurable: a fixed latency before the first token, an
+output speed in tokens per second, a cap on output tokens (answers beyond it, or beyond
+the request's max_tokens, are cut off with finish_reason 'length'), one answer in N cut
+off regardless (picked by a hash of the prompt, so the same prompts are cut off in every
+run whatever the request order), and every Nth request rejected with a 429. Tokens are
+counted as characters / 4.
+
+Usage:
+    python mock_llm_server.py [--port 8000] [--latency 0.5] [--tokens-per-second 100] [--rate-limit-every 10]
+    OPENAI_BASE_URL=http://127.0.0.1:8000/v1 OPENAI_API_KEY=mock python ../pdf_cleaner/pdf_text_cleaner.py ...
+"""
+
+import argparse
+import json
+import threading
+import time
+import zlib
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STREAM_PIECE_CHARS = 16  # content characters per streamed event, roughly four tokens
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so connection reuse is observable
+
+    def setup(self):
+        super().setup()
+        self.server.mock.record_connection()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            self.send_header('Retry-After', f'{self.server.mock.retry_after:g}')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_bytes(self, data):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, payload, include_usage):
+        """Send a chat completion as server-sent chat.completion.chunk events (chunked transfer encoding)."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        choice = payload['choices'][0]
+        content = choice['message']['content']
+        base = {key: payload[key] for key in ('id', 'created', 'model')}
+        base['object'] = 'chat.completion.chunk'
+        pieces = [content[i:i + STREAM_PIECE_CHARS] for i in range(0, len(content), STREAM_PIECE_CHARS)]
+        tokens_per_second = self.server.mock.tokens_per_second
+        events = [{**base, 'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': piece},
+                                        'finish_reason': None}]} for piece in pieces]
+        events.append({**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': choice['finish_reason']}]})
+        if include_usage:
+            events.append({**base, 'choices': [], 'usage': payload['usage']})
+        for event in events:
+            if tokens_per_second and event['choices'] and event['choices'][0]['delta'].get('content'):
+                time.sleep(len(event['choices'][0]['delta']['content']) / 4 / tokens_per_second)
+            self._write_chunk(f'data: {json.dumps(event)}\n\n'.encode('utf-8'))
+        self._write_chunk(b'data: [DONE]\n\n')
+        self._write_chunk(b'')
+
+    def _write_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        path = self.path.split('?')[0].rstrip('/')
+        mock = self.server.mock
+        if path.endswith('/chat/completions'):
+            request = json.loads(body or b'{}')
+            status, payload = mock.chat_completion(request)
+            if request.get('stream') and status == 200:
+                self._send_stream(payload, (request.get('stream_options') or {}).get('include_usage'))
+            else:
+                self._send_json(status, payload)
+        elif path.endswith('/files'):
+            self._send_json(200, mock.upload_file(self.headers['Content-Type'], body))
+        elif path.endswith('/batches'):
+            self._send_json(*mock.create_batch(json.loads(body or b'{}')))
+        else:
+            self._send_json(404, {'error': {'message': f'unknown path {self.path}'}})
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].rstrip('/').split('/')
+        mock = self.server.mock
+        if parts[-1] == 'content' and parts[-3] == 'files' and parts[-2] in mock.files:
+            self._send_bytes(mock.files[parts[-2]]['data'])
+        elif parts[-2] == 'batches' and parts[-1] in mock.batches:
+            self._send_json(200, mock.batches[parts[-1]])
+        else:
+            self._send_json(404, {'error': {'message': f'unknown path {self.path}'}})
+
+
+class MockLLMServer:
+    """Threaded mock chat-completions server; use as a context manager.
+
+    latency: seconds before the first token of every answer
+    tokens_per_second: output speed (None: answers come at once)
+    max_output_tokens: longest possible answer, in addition to the request's max_tokens
+    length_every: cut off one answer in N halfway with finish_reason 'length' (0: never)
+    rate_limit_every: reject every Nth request with a 429 and a Retry-After header (0: never)
+    retry_after: seconds sent in the Retry-After header
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, tokens_per_second=None, max_output_tokens=None,
+                 length_every=0, rate_limit_every=0, retry_after=1.0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.max_output_tokens = max_output_tokens
+        self.length_every = length_every
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.connections = 0
+        self.requests = 0
+        self.rate_limited = 0
+        self.input_chars = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.files = {}
+        self.batches = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def record_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def reset_counters(self):
+        with self._lock:
+            self.connections = self.requests = self.rate_limited = 0
+            self.input_chars = self.prompt_tokens = self.completion_tokens = 0
+
+    def reply(self, messages):
+        """Content of the assistant message: the last user message, echoed back."""
+        user_messages = [m['content'] for m in messages if m.get('role') == 'user']
+        return user_messages[-1] if user_messages else ''
+
+    def chat_completion(self, request):
+        """Answer a chat-completions HTTP request: (status, payload)."""
+        with self._lock:
+            attempt = self.requests + self.rate_limited + 1
+            limited = self.rate_limit_every and attempt % self.rate_limit_every == 0
+            if limited:
+                self.rate_limited += 1
+        if limited:
+            return 429, {'error': {'message': 'Rate limit reached (mock)', 'type': 'requests',
+                                   'code': 'rate_limit_exceeded'}}
+        if self.latency:
+            time.sleep(self.latency)
+        payload = self.completion(request)
+        # A streamed answer is paced while it is sent
+        if self.tokens_per_second and not request.get('stream'):
+            time.sleep(payload['usage']['completion_tokens'] / self.tokens_per_second)
+        return 200, payload
+
+    def completion(self, request):
+        """The chat.completion object for a request, with the configured cut-offs applied."""
+        messages = request.get('messages', [])
+        prompt_chars = sum(len(m.get('content') or '') for m in messages)
+        content = self.reply(messages)
+        with self._lock:
+            self.requests += 1
+            number = self.requests
+            self.input_chars += prompt_chars
+        finish_reason = 'stop'
+        limits = [limit for limit in (request.get('max_tokens'), self.max_output_tokens) if limit]
+        if limits and len(content) // 4 > min(limits):
+            content = content[:min(limits) * 4]
+            finish_reason = 'length'
+        if self.length_every and zlib.crc32(json.dumps(messages).encode('utf-8')) % self.length_every == 0:
+            content = content[:len(content) // 2]
+            finish_reason = 'length'
+        usage = {
+            'prompt_tokens': prompt_chars // 4,
+            'completion_tokens': len(content) // 4,
+            'total_tokens': prompt_chars // 4 + len(content) // 4,
+        }
+        with self._lock:
+            self.prompt_tokens += usage['prompt_tokens']
+            self.completion_tokens += usage['completion_tokens']
+        return {
+            'id': f'chatcmpl-mock-{number}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'mock'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': finish_reason,
+            }],
+            'usage': usage,
+        }
+
+    def upload_file(self, content_type, body):
+        """Store a multipart/form-data upload (fields 'file' and 'purpose'); returns the file object."""
+        header = b'Content-Type: ' + content_type.encode() + b'\r\n\r\n'
+        message = BytesParser(policy=HTTP).parsebytes(header + body)
+        fields = {part.get_param('name', header='content-disposition'): part for part in message.iter_parts()}
+        file_part = fields['file']
+        purpose = fields['purpose'].get_payload(decode=True).decode() if 'purpose' in fields else 'batch'
+        return self._add_file(file_part.get_payload(decode=True), file_part.get_filename() or 'upload', purpose)
+
+    def _add_file(self, data, filename, purpose):
+        with self._lock:
+            file_id = f'file-mock-{len(self.files) + 1}'
+            self.files[file_id] = {
+                'id': file_id,
+                'object': 'file',
+                'bytes': len(data),
+                'created_at': int(time.time()),
+                'filename': filename,
+                'purpose': purpose,
+                'status': 'processed',
+                'data': data,
+            }
+        return {key: value for key, value in self.files[file_id].items() if key != 'data'}
+
+    def create_batch(self, request):
+        """Create a batch job for an uploaded file and run it in a background thread."""
+        input_file = self.files.get(request.get('input_file_id'))
+        if input_file is None:
+            return 404, {'error': {'message': 'unknown input_file_id'}}
+        with self._lock:
+            batch_id = f'batch-mock-{len(self.batches) + 1}'
+            self.batches[batch_id] = batch = {
+                'id': batch_id,
+                'object': 'batch',
+                'endpoint': request.get('endpoint'),
+                'input_file_id': input_file['id'],
+                'completion_window': request.get('completion_window', '24h'),
+                'created_at': int(time.time()),
+                'status': 'in_progress',
+                'output_file_id': None,
+                'error_file_id': None,
+                'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+            }
+        threading.Thread(target=self._run_batch, args=(batch, input_file['data']), daemon=True).start()
+        return 200, batch
+
+    def _run_batch(self, batch, data):
+        lines = [json.loads(line) for line in data.decode('utf-8').splitlines() if line.strip()]
+        batch['request_counts']['total'] = len(lines)
+        output, errors = [], []
+        for line in lines:
+            # Batch jobs have no latency or rate limits of their own
+            status, payload = 200, self.completion(line['body'])
+            entry = {'id': f"batch-req-{line['custom_id']}", 'custom_id': line['custom_id'],
+                     'response': {'status_code': status, 'body': payload}, 'error': None}
+            (output if status == 200 else errors).append(json.dumps(entry) + '\n')
+            batch['request_counts']['completed' if status == 200 else 'failed'] += 1
+        if output:
+            batch['output_file_id'] = self._add_file(''.join(output).encode('utf-8'), 'output.jsonl',
+                                                     'batch_output')['id']
+        if errors:
+            batch['error_file_id'] = self._add_file(''.join(errors).encode('utf-8'), 'errors.jsonl',
+                                                    'batch_output')['id']
+        batch['status'] = 'completed'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a mock chat-completions server')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before the first token')
+    parser.add_argument('--tokens-per-second', type=float, default=None, help='output speed')
+    parser.add_argument('--max-output-tokens', type=int, default=None, help='cut longer answers off (length)')
+    parser.add_argument('--length-every', type=int, default=0, help='cut off one answer in N (length)')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='reject every Nth request with a 429')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After seconds of a 429')
+    args = parser.parse_args()
+
+    server = MockLLMServer(port=args.port, latency=args.latency, tokens_per_second=args.tokens_per_second,
+                           max_output_tokens=args.max_output_tokens, length_every=args.length_every,
+                           rate_limit_every=args.rate_limit_every, retry_after=args.retry_after)
+    print(f"Serving mock chat completions at {server.base_url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+        print(f"connections: {server.connections}, requests: {server.requests}, "
+              f"rate limited: {server.rate_limited}, tokens: {server.prompt_tokens} in / {server.completion_tokens} out")
+
+
+if __name__ == '__main__':
+    main()
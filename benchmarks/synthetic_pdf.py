@@ -0,0 +1,87 @@
+"""
+Write synthetic multi-page PDFs (plain Helvetica text, no dependencies) for the benchmarks.
+
+The pages imitate an academic paper as extracted by PyPDF2: a running header, margin
+line numbers, body text with hyphenated line breaks, and a page number footer.
+
+Usage:
+    python synthetic_pdf.py out.pdf [--pages 2000]
+"""
+
+import argparse
+import random
+
+WORDS = ("the of and to in we is that for on with as by this are be an mesh surface energy "
+         "optimization parameterization method results figure table equation vertex triangle "
+         "convergence distortion injective mapping boundary").split()
+
+
+def page_lines(page_num, n_lines, rng):
+    lines = ["Journal of Synthetic Geometry, Vol. 42 (2024)"]
+    for k in range(n_lines):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 14))]
+        line = ' '.join(words)
+        if rng.random() < 0.1:
+            line += ' compu-'
+        elif rng.random() < 0.2:
+            line += '.'
+        lines.append(f"{page_num * n_lines + k + 1} {line}")
+    lines.append(str(page_num + 1))
+    return lines
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_pdf(path, n_pages=100, lines_per_page=45, seed=0):
+    """Write an n_pages PDF with text content to path."""
+    rng = random.Random(seed)
+    objects = []  # object bodies, object k + 1 at index k
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    pages = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    kids = []
+    for page_num in range(n_pages):
+        ops = ["BT", "/F1 9 Tf", "11 TL", "50 760 Td"]
+        for line in page_lines(page_num, lines_per_page, rng):
+            ops.append(f"({_escape(line)}) Tj T*")
+        ops.append("ET")
+        stream = '\n'.join(ops).encode('latin-1')
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        kids.append(add(("<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] "
+                         "/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>"
+                         % (pages, font, content)).encode()))
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages
+    objects[pages - 1] = ("<< /Type /Pages /Kids [%s] /Count %d >>"
+                          % (' '.join(f"{kid} 0 R" for kid in kids), len(kids))).encode()
+
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                % (len(objects) + 1, catalog, xref))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic multi-page PDF')
+    parser.add_argument('out_path')
+    parser.add_argument('--pages', type=int, default=100)
+    args = parser.parse_args()
+    write_pdf(args.out_path, args.pages)
+
+
+if __name__ == '__main__':
+    main()
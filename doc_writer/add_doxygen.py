@@ -1,21 +1,80 @@
 import argparse
-from openai import OpenAI
 from analyze_cpp import *
 
+import asyncio
+import hashlib
 import json
 import os
 import shutil
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from gpt_common.batch import POLL_INTERVAL, run_batch
+from gpt_common.cache import configure_cache
+from gpt_common.chat import chat_completion, async_chat_completion
+from gpt_common.client import configure_client_pool, get_async_client
+from gpt_common.metrics import configure_metrics, print_summary
+from gpt_common.rate_limit import configure_rate_limiter
+
+MODEL = "gpt-4-1106-preview"
+# MODEL = 'gpt-3.5-turbo-1106'
+
+MULTI_SYSTEM_PROMPT = """As a skilled C++ programmer with expertise in Doxygen documentation, your task is to add Doxygen comments to a C++ file provided by the user. 
+                What to Do:
+                1. Return the complete C++ code with Doxygen documentation included.
+                2. If the task is incomplete within one response, ensure to add Doxygen comments up to where you've reached and end the response with '//continue'.
+                What Not to Do:
+                1. Do not alter the original C++ code provided by the user.
+                2. Do not alter the existing Doxygen comments provided by the user.
+                3. Do not add explanation in your response. """
+
+# A continuation request sends only the code that is not documented yet, plus the last
+# documented lines as an anchor, instead of the whole conversation so far
+MULTI_CONTINUE_PROMPT = """Continue adding Doxygen documentation to a C++ file. The code before has already been documented, ending with these lines:
+{anchor}
+Do not repeat them. Add Doxygen documentation to the following C++ code: \n{code}"""
+
+MAX_CONTINUE_ITER = 10
+
+# Number of documented lines sent as the anchor of a continuation request
+CONTINUE_ANCHOR_LINES = 8
+
+# Insertion patches: the model returns only the comments, which are spliced into the untouched source
+PATCH_SYSTEM_PROMPT = """As a skilled C++ programmer with expertise in Doxygen documentation, your task is to write Doxygen comments for a C++ file provided by the user. 
+                Every line of the code starts with its line number and '|'.
+                What to Do:
+                1. Write a Doxygen comment for every class, struct, enum, function, method and member that has none.
+                2. Return a JSON object {"comments": [...]}, where every item is {"line": the line number of the first line of the declaration, "symbol": the name it declares, "comment": the Doxygen comment}.
+                What Not to Do:
+                1. Do not return the code.
+                2. Do not write comments for declarations that already have Doxygen comments.
+                3. Do not add explanation in your response. """
+
+PATCH_PROMPT = "Write Doxygen comments for the following C++ code: \n"
+
+# Selective documentation: only the undocumented declarations are sent, each with a few lines of context
+UNDOCUMENTED_PROMPT = "Write Doxygen comments for the declarations on lines {lines} of the following excerpts of a C++ file (the other lines are context, '...' marks omitted code): \n"
+
+# Lines sent above an undocumented declaration, and lines of its head sent at most
+UNDOCUMENTED_CONTEXT_LINES = 2
+UNDOCUMENTED_HEAD_LINES = 8
+
+# Changes whenever the prompts change, so that outputs generated with older prompts are refreshed
+PROMPT_VERSION = hashlib.sha256((MULTI_SYSTEM_PROMPT + MULTI_CONTINUE_PROMPT).encode('utf-8')).hexdigest()[:12]
+PATCH_PROMPT_VERSION = hashlib.sha256((PATCH_SYSTEM_PROMPT + PATCH_PROMPT).encode('utf-8')).hexdigest()[:12]
+UNDOCUMENTED_PROMPT_VERSION = hashlib.sha256((PATCH_SYSTEM_PROMPT + UNDOCUMENTED_PROMPT).encode('utf-8')).hexdigest()[:12]
+
+# Records, for every documented header, what its output was generated from
+MANIFEST_NAME = '.doxygen_manifest.json'
 
 def add_doxygen_json(code_content):
     """
     Sends code content to GPT API to add Doxygen documentation.
     The response is in JSON format.
     """
-    client = OpenAI()
-
-    response = client.chat.completions.create(
-    model="gpt-4-1106-preview",
-    # model='gpt-3.5-turbo-1106',
+    result = chat_completion(
+    model=MODEL,
     response_format={ "type": "json_object" },
     messages=[
         {
@@ -38,8 +97,8 @@ def add_doxygen_json(code_content):
     presence_penalty=0
     )
 
-    if response.choices[0].finish_reason == 'stop':
-        output = response.choices[0].message.content
+    if result.finish_reason == 'stop':
+        output = result.content
         json_output = json.loads(output)
         if json_output['finished']:
             return json_output['code']   
@@ -48,11 +107,8 @@ def add_doxygen(code_content):
     """
     Sends code content to GPT API to add Doxygen documentation.
     """
-    client = OpenAI()
-
-    response = client.chat.completions.create(
-        model="gpt-4-1106-preview",
-        # model='gpt-3.5-turbo-1106',
+    result = chat_completion(
+        model=MODEL,
         messages=[
             {
                 "role": "system",
@@ -75,36 +131,25 @@ def add_doxygen(code_content):
     )
 
     # if finish_reason is not 'stop', report error and exit
-    if response.choices[0].finish_reason != 'stop':
+    if result.finish_reason != 'stop':
         print("Error: GPT failed to finish the task.")
         return
 
-    output = response.choices[0].message.content
+    output = result.content
     # Remove '```cpp' and '```' from the output
     output = output.replace('```cpp', '')
     output = output.replace('```', '')
 
     return output
 
-def add_doxygen_multi(code_content):
+def multi_chat_history(code_content):
     """
-    Sends code content to GPT API to add Doxygen documentation.
-    Multiple requests are sent if the response is too long for one request.
+    Build the initial chat history used by add_doxygen_multi.
     """
-    client = OpenAI()
-
-    chat_history = [
+    return [
             {
                 "role": "system",
-                "content": 
-                """As a skilled C++ programmer with expertise in Doxygen documentation, your task is to add Doxygen comments to a C++ file provided by the user. 
-                What to Do:
-                1. Return the complete C++ code with Doxygen documentation included.
-                2. If the task is incomplete within one response, ensure to add Doxygen comments up to where you've reached and end the response with '//continue'.
-                What Not to Do:
-                1. Do not alter the original C++ code provided by the user.
-                2. Do not alter the existing Doxygen comments provided by the user.
-                3. Do not add explanation in your response. """
+                "content": MULTI_SYSTEM_PROMPT
             },
             {
                 "role": "user",
@@ -112,82 +157,488 @@ def add_doxygen_multi(code_content):
             }
         ]
 
-    response = client.chat.completions.create(
-        model="gpt-4-1106-preview",
-        # model='gpt-3.5-turbo-1106',
-        messages=chat_history,
-        temperature=1,
-        max_tokens=4095,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0
-    )
+def merge_multi_responses(response_list):
+    """
+    Merge the responses of a '//continue' conversation into the documented code.
+    """
+    output = '\n'.join(response_list)
+    # Remove '```cpp' and '```' from the output
+    output = output.replace('```cpp', '')
+    output = output.replace('```', '')
+    # Remove '//to be continued' from the output
+    output = output.replace('//continue', '')
+    return output
 
-    # if finish_reason is not 'stop', report error and exit
-    if response.choices[0].finish_reason != 'stop':
-        print("Error: GPT failed to finish the task.")
-        return
-    response_list = [response.choices[0].message.content]
-    chat_history.append(response.choices[0].message)
+def continuation_chat_history(code_lines, start, doc_lines):
+    """
+    Build the chat history of a continuation request: the source from line `start` on,
+    anchored by the last documented lines.
+    """
+    anchor = '\n'.join(doc_lines[-CONTINUE_ANCHOR_LINES:])
+    code = '\n'.join(code_lines[start:])
+    return [
+            {
+                "role": "system",
+                "content": MULTI_SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": MULTI_CONTINUE_PROMPT.format(anchor=anchor, code=code)
+            }
+        ]
+
+def match_source_lines(code_lines, start, doc_lines):
+    """
+    Follow documented lines through the source, starting at code_lines[start].
+    Returns the index of the first source line not found in doc_lines and the number
+    of doc_lines up to the last one found in the source.
+    """
+    i = start
+    matched = 0
+    for n, line in enumerate(doc_lines):
+        while i < len(code_lines) and not code_lines[i].strip():
+            i += 1
+        if line.strip() and i < len(code_lines) and line.strip() == code_lines[i].strip():
+            i += 1
+            matched = n + 1
+    return i, matched
 
-    # While '//continue' is in the current response, continue to send requests
+def drop_repeated_anchor(doc_lines, new_lines, next_code_lines):
+    """
+    Drop the lines at the start of a continuation that repeat the end of the documented code,
+    unless the remaining source really starts with them.
+    """
+    head = [(n, line.strip()) for n, line in enumerate(new_lines) if line.strip()][:CONTINUE_ANCHOR_LINES]
+    tail = [line.strip() for line in doc_lines[-4 * CONTINUE_ANCHOR_LINES:] if line.strip()][-CONTINUE_ANCHOR_LINES:]
+    code_head = [line.strip() for line in next_code_lines[:4 * CONTINUE_ANCHOR_LINES] if line.strip()]
+    for k in range(min(len(head), len(tail)), 0, -1):
+        repeated = [line for _, line in head[:k]]
+        if repeated == tail[-k:] and repeated != code_head[:k]:
+            return new_lines[head[k - 1][0] + 1:]
+    return new_lines
+
+def fold_response(code_lines, doc_lines, start, content):
+    """
+    Add one response to the documented lines of a chunk.
+    Returns (doc_lines, start, finished), where start is the first source line that is not documented yet.
+    When the response asks to continue, the lines after the last source line it reached are dropped:
+    they are the comment of the next declaration, which may be cut short, and are written again with it.
+    """
+    new_lines = merge_multi_responses([content]).split('\n')
+    if doc_lines:
+        new_lines = drop_repeated_anchor(doc_lines, new_lines, code_lines[start:])
+    end, matched = match_source_lines(code_lines, start, new_lines)
+    finished = '//continue' not in content or not ''.join(code_lines[end:]).strip()
+    if not finished:
+        new_lines = new_lines[:matched]
+    return doc_lines + new_lines, end, finished
+
+def add_doxygen_chunk(code_chunk, on_delta=None):
+    """
+    Sends a code chunk to GPT API to add Doxygen documentation.
+    Multiple requests are sent if the response is too long for one request; each continuation
+    only carries the code that is still undocumented, so requests do not grow with the history.
+    With on_delta, the responses are streamed and every piece is passed to it as it arrives.
+    """
+    code_lines = code_chunk.split('\n')
+    chat_history = multi_chat_history(code_chunk)
+    doc_lines = []
+    start = 0
+
+    # While the current response ends with '//continue', send a continuation request
     iter = 0
-    max_iter = 10
-    while '//continue' in response_list[-1] and iter < max_iter:
-        print("iter: ", iter)
-        iter += 1
-        chat_history.append({
-            "role": "user",
-            "content": "Please continue adding doxygen documentation from the previous response. \
-            Please only include the documented code in your response, without any explanation. \
-            If you cannot finish the task in one response, you should return the code with doxygen documentation added so far \
-            and add '//continue' as the last line of your response."
-        })
-        response = client.chat.completions.create(
-            model="gpt-4-1106-preview",
-            # model='gpt-3.5-turbo-1106',
+    while True:
+        result = chat_completion(
+            model=MODEL,
             messages=chat_history,
+            on_delta=on_delta,
+            label='doxygen' if start == 0 else 'doxygen-continue',
             temperature=1,
             max_tokens=4095,
             top_p=1,
             frequency_penalty=0,
             presence_penalty=0
         )
-        if response.choices[0].finish_reason != 'stop':
+        # if finish_reason is not 'stop', report error and exit
+        if result.finish_reason != 'stop':
             print("Error: GPT failed to finish the task.")
             return
-        response_list.append(response.choices[0].message.content)
-        chat_history.append(response.choices[0].message)
+        doc_lines, end, finished = fold_response(code_lines, doc_lines, start, result.content)
+        if finished:
+            break
+        # no progress, or too many rounds
+        if end == start or iter == MAX_CONTINUE_ITER:
+            print("Error: GPT failed to finish the task.")
+            return
+        print("iter: ", iter)
+        iter += 1
+        start = end
+        chat_history = continuation_chat_history(code_lines, start, doc_lines)
 
-    # Merge all responses into one
-    output = '\n'.join(response_list)
-    # Remove '```cpp' and '```' from the output
-    output = output.replace('```cpp', '')
-    output = output.replace('```', '')
-    # Remove '//to be continued' from the output
-    output = output.replace('//continue', '')
+    return '\n'.join(doc_lines)
 
-    return output
+async def add_doxygen_chunk_async(code_chunk, client, semaphore, on_delta=None):
+    """
+    Async version of add_doxygen_chunk.
+    The continuation rounds of one chunk still run in order, while the semaphore
+    caps the number of requests in flight across all chunks and files.
+    """
+    code_lines = code_chunk.split('\n')
+    chat_history = multi_chat_history(code_chunk)
+    doc_lines = []
+    start = 0
+
+    iter = 0
+    while True:
+        queued_at = time.perf_counter()
+        async with semaphore:
+            result = await async_chat_completion(
+                model=MODEL,
+                client=client,
+                messages=chat_history,
+                on_delta=on_delta,
+                label='doxygen' if start == 0 else 'doxygen-continue',
+                queued_at=queued_at,
+                temperature=1,
+                max_tokens=4095,
+                top_p=1,
+                frequency_penalty=0,
+                presence_penalty=0
+            )
+        # if finish_reason is not 'stop', report error and exit
+        if result.finish_reason != 'stop':
+            print("Error: GPT failed to finish the task.")
+            return
+        doc_lines, end, finished = fold_response(code_lines, doc_lines, start, result.content)
+        if finished:
+            break
+        # no progress, or too many rounds
+        if end == start or iter == MAX_CONTINUE_ITER:
+            print("Error: GPT failed to finish the task.")
+            return
+        print("iter: ", iter)
+        iter += 1
+        start = end
+        chat_history = continuation_chat_history(code_lines, start, doc_lines)
+
+    return '\n'.join(doc_lines)
+
+def restore_blank_lines(code_chunk, doc_chunk):
+    """
+    Give a documented chunk the leading and trailing blank lines of the original chunk,
+    so that chunks documented separately join back with the original layout.
+    """
+    leading = code_chunk[:len(code_chunk) - len(code_chunk.lstrip('\n'))]
+    trailing = code_chunk[len(code_chunk.rstrip('\n')):]
+    return leading + doc_chunk.strip('\n') + trailing
+
+def add_doxygen_multi(code_content, on_delta=None):
+    """
+    Sends code content to GPT API to add Doxygen documentation.
+    The code is split at top-level declarations and every chunk is documented by its own request(s);
+    chunks without declarations are kept as they are.
+    """
+    doc_chunks = []
+    for code_chunk in split_code(code_content):
+        if not has_declarations(code_chunk):
+            doc_chunks.append(code_chunk)
+            continue
+        doc_chunk = add_doxygen_chunk(code_chunk, on_delta)
+        if not doc_chunk:
+            return
+        doc_chunks.append(restore_blank_lines(code_chunk, doc_chunk))
+    return ''.join(doc_chunks)
+
+async def add_doxygen_multi_async(code_content, client, semaphore, on_delta=None):
+    """
+    Async version of add_doxygen_multi; the chunks of a file are documented concurrently.
+    """
+    async def document(code_chunk):
+        if not has_declarations(code_chunk):
+            return code_chunk
+        doc_chunk = await add_doxygen_chunk_async(code_chunk, client, semaphore, on_delta)
+        return restore_blank_lines(code_chunk, doc_chunk) if doc_chunk else None
+
+    doc_chunks = await asyncio.gather(*[document(code_chunk) for code_chunk in split_code(code_content)])
+    if all(doc_chunk is not None for doc_chunk in doc_chunks):
+        return ''.join(doc_chunks)
 
 
-def process_cpp_file(input_file_path, output_file_path):
+def patch_line_ranges(code_content):
+    """
+    Split the code for insertion-patch requests: the (first, last) 0-based line ranges of the chunks
+    of split_code, sized by the comments they need (estimate_patch_tokens) instead of the documented code.
+    A line shared by two chunks is sent with both; chunks without declarations are not sent.
+    """
+    ranges = []
+    start = 0
+    for code_chunk in split_code(code_content, estimate=estimate_patch_tokens):
+        end = start + len(code_chunk)
+        if has_declarations(code_chunk):
+            ranges.append((code_content.count('\n', 0, start), code_content.count('\n', 0, end - 1)))
+        start = end
+    return ranges
+
+def undocumented_excerpts(code_content, token_limit=4095):
+    """
+    Group the undocumented declarations of the code (see find_undocumented) for insertion-patch requests.
+    Each declaration is sent with the UNDOCUMENTED_CONTEXT_LINES lines above it and its head (a function's
+    body is left out); overlapping excerpts are merged, and a request gets as many declarations as the
+    comments expected for them (see estimate_patch_tokens) fit in the limit.
+    :return: A list of (excerpts, targets) pairs: the (first, last) 0-based line ranges to send and
+             the lines of the declarations to document.
+    """
+    undocumented, n_declarations = find_undocumented(code_content)
+    print(f"{len(undocumented)} of {n_declarations} declarations undocumented")
+    groups = []
+    group_tokens = 0
+    for kind, first, last in undocumented:
+        tokens = DOC_TOKENS_PER_OBJECT[kind] + PATCH_TOKENS_PER_OBJECT
+        if not groups or group_tokens + tokens > token_limit:
+            groups.append(([], []))
+            group_tokens = 0
+        group_tokens += tokens
+        excerpts, targets = groups[-1]
+        first_sent = max(first - UNDOCUMENTED_CONTEXT_LINES, 0)
+        last_sent = min(last, first + UNDOCUMENTED_HEAD_LINES - 1)
+        if excerpts and first_sent <= excerpts[-1][1] + 2:
+            # Overlapping or one line apart: extend the previous excerpt instead of eliding a single line
+            excerpts[-1] = (excerpts[-1][0], max(excerpts[-1][1], last_sent))
+        else:
+            excerpts.append((first_sent, last_sent))
+        targets.append(first)
+    return groups
+
+def patch_request(code_lines, excerpts, targets=None):
+    """
+    Build the arguments of an insertion-patch request for the (first, last) line ranges in excerpts,
+    sent with their line numbers. With targets, only the declarations on those lines are to be documented.
+    """
+    numbered = '\n...\n'.join('\n'.join(f"{k + 1}|{code_lines[k]}" for k in range(first, last + 1))
+                               for first, last in excerpts)
+    if targets is None:
+        prompt = PATCH_PROMPT
+    else:
+        prompt = UNDOCUMENTED_PROMPT.format(lines=', '.join(str(k + 1) for k in targets))
+    return dict(
+        model=MODEL,
+        response_format={"type": "json_object"},
+        messages=[
+            {
+                "role": "system",
+                "content": PATCH_SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": prompt + numbered
+            }
+        ],
+        temperature=1,
+        max_tokens=4095,
+        top_p=1,
+        frequency_penalty=0,
+        presence_penalty=0
+    )
+
+def patch_requests(code_content, undocumented=False):
+    """
+    Build the insertion-patch requests of a file: one per chunk of the code, or with undocumented,
+    only for its undocumented declarations (none if everything is documented already).
+    """
+    code_lines = code_content.split('\n')
+    if undocumented:
+        return [patch_request(code_lines, excerpts, targets)
+                for excerpts, targets in undocumented_excerpts(code_content)]
+    return [patch_request(code_lines, [(first, last)]) for first, last in patch_line_ranges(code_content)]
+
+def read_patch(result):
+    """
+    Read the comments of an insertion-patch response; None (after reporting the error) if there are none.
+    """
+    if result is None or result.finish_reason != 'stop':
+        print("Error: GPT failed to finish the task.")
+        return None
+    try:
+        comments = json.loads(result.content)['comments']
+        if not isinstance(comments, list):
+            raise TypeError('comments is not a list')
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Error: GPT returned a malformed patch ({e}).")
+        return None
+    return [comment for comment in comments if isinstance(comment, dict)]
+
+def add_doxygen_patch(code_content, on_delta=None, undocumented=False):
+    """
+    Sends code content to GPT API to write Doxygen comments, returned as insertion patches
+    ({line, symbol, comment} items) and spliced into the original code, which stays unchanged.
+    Only the comments are generated, so a request covers much more code than with add_doxygen_multi.
+    With undocumented, only the declarations without a Doxygen comment are sent, with minimal context.
+    """
+    label = 'doxygen-undocumented' if undocumented else 'doxygen-patch'
+    patches = []
+    for request in patch_requests(code_content, undocumented):
+        result = chat_completion(**request, on_delta=on_delta, label=label)
+        comments = read_patch(result)
+        if comments is None:
+            return
+        patches.extend(comments)
+    return splice_comments(code_content, patches)
+
+async def add_doxygen_patch_async(code_content, client, semaphore, on_delta=None, undocumented=False):
+    """
+    Async version of add_doxygen_patch; the requests of a file are sent concurrently.
+    """
+    label = 'doxygen-undocumented' if undocumented else 'doxygen-patch'
+
+    async def send(request):
+        queued_at = time.perf_counter()
+        async with semaphore:
+            result = await async_chat_completion(**request, client=client, on_delta=on_delta, label=label,
+                                                 queued_at=queued_at)
+        return read_patch(result)
+
+    results = await asyncio.gather(*[send(request) for request in patch_requests(code_content, undocumented)])
+    if all(comments is not None for comments in results):
+        return splice_comments(code_content, [comment for comments in results for comment in comments])
+
+
+def finish_part_file(part_file_path, output_file_path, doc_code):
+    """
+    Replace the output with the finished code written to its part file, or remove the part file on failure.
+    """
+    if doc_code:
+        with open(part_file_path, 'w') as file:
+            file.write(doc_code)
+        os.replace(part_file_path, output_file_path)
+    elif os.path.exists(part_file_path):
+        os.remove(part_file_path)
+
+def process_cpp_file(input_file_path, output_file_path, stream=False, mode='full'):
     """
     Process a C++ file, adding Doxygen comments to it.
+    With stream, the responses are written to OUTPUT.part as they arrive, and the finished
+    code replaces the output file in one step.
+    In the 'patch' and 'undocumented' modes, only the comments are requested (add_doxygen_patch);
+    streaming then only reports the speed.
     """
     print(input_file_path)
     with open(input_file_path, 'r') as file:
         cpp_code = file.read()
 
     # cpp_code = clean_code(cpp_code)
-    doc_code = add_doxygen_multi(cpp_code)
+    if mode != 'full':
+        doc_code = add_doxygen_patch(cpp_code, on_delta=(lambda delta: None) if stream else None,
+                                     undocumented=mode == 'undocumented')
+    elif stream:
+        part_file_path = output_file_path + '.part'
+        with open(part_file_path, 'w', buffering=1) as part_file:  # line buffered, so progress shows up
+            doc_code = add_doxygen_multi(cpp_code, on_delta=part_file.write)
+        finish_part_file(part_file_path, output_file_path, doc_code)
+        return doc_code
+    else:
+        doc_code = add_doxygen_multi(cpp_code)
     if doc_code:
         with open(output_file_path, 'w') as file:
             file.write(doc_code)
+    return doc_code
 
-def process_source_dir(input_dir_path, output_dir_path):
+async def process_cpp_file_async(input_file_path, output_file_path, client, semaphore, stream=False, mode='full'):
     """
-    Recursively process all C++ header files in a directory, adding Doxygen comments to them.
-    Save the processed files to the output directory (preserving the directory structure).
+    Async version of process_cpp_file.
+    The chunks of a file are documented concurrently, so with stream the responses are not
+    written out as they arrive; only the speed is reported and the output replaced in one step.
+    """
+    print(input_file_path)
+    with open(input_file_path, 'r') as file:
+        cpp_code = file.read()
+
+    if mode != 'full':
+        doc_code = await add_doxygen_patch_async(cpp_code, client, semaphore,
+                                                 on_delta=(lambda delta: None) if stream else None,
+                                                 undocumented=mode == 'undocumented')
+    elif stream:
+        doc_code = await add_doxygen_multi_async(cpp_code, client, semaphore, on_delta=lambda delta: None)
+        finish_part_file(output_file_path + '.part', output_file_path, doc_code)
+        return doc_code
+    else:
+        doc_code = await add_doxygen_multi_async(cpp_code, client, semaphore)
+    if doc_code:
+        with open(output_file_path, 'w') as file:
+            file.write(doc_code)
+    return doc_code
+
+def file_hash(file_path):
+    """
+    SHA-256 of a file's content.
+    """
+    with open(file_path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def load_manifest(output_dir_path):
+    """
+    Load the manifest of a previous run from the output directory (empty if there is none).
+    """
+    try:
+        with open(os.path.join(output_dir_path, MANIFEST_NAME), 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(output_dir_path, manifest):
+    """
+    Save the manifest to the output directory.
+    """
+    manifest_path = os.path.join(output_dir_path, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def prompt_version(mode='full'):
+    """
+    Version of the prompts an output is generated with in a documentation mode.
+    """
+    return {'full': PROMPT_VERSION, 'patch': PATCH_PROMPT_VERSION, 'undocumented': UNDOCUMENTED_PROMPT_VERSION}[mode]
+
+def manifest_entry(input_file_path, output_file_path, mode='full'):
+    """
+    Describe what an output header was generated from.
+    """
+    return {
+        "input_hash": file_hash(input_file_path),
+        "prompt_version": prompt_version(mode),
+        "model": MODEL,
+        "output_hash": file_hash(output_file_path)
+    }
+
+def is_up_to_date(entry, input_file_path, output_file_path, mode='full'):
+    """
+    Check whether the output header was generated from the current input with the current prompt and model,
+    and has not been modified since.
+    """
+    if not entry or not os.path.exists(output_file_path):
+        return False
+    return (entry.get("prompt_version") == prompt_version(mode) and entry.get("model") == MODEL
+            and entry.get("input_hash") == file_hash(input_file_path)
+            and entry.get("output_hash") == file_hash(output_file_path))
+
+def copy_if_changed(src_file_path, dst_file_path):
+    """
+    Copy a file unless the destination already has the same size and modification time.
+    """
+    if os.path.exists(dst_file_path):
+        src_stat = os.stat(src_file_path)
+        dst_stat = os.stat(dst_file_path)
+        if src_stat.st_size == dst_stat.st_size and int(src_stat.st_mtime) == int(dst_stat.st_mtime):
+            return
+    shutil.copy2(src_file_path, dst_file_path)  # copy2 keeps the mtime for the next comparison
+
+def walk_source_dir(input_dir_path, output_dir_path, manifest, mode='full'):
+    """
+    Walk a source directory, mirroring its structure in the output directory.
+    Changed non-header files are copied; yields (input, output, relative) paths of the headers
+    whose output is missing or out of date according to the manifest.
+    Outputs without a manifest entry (e.g. of runs before the manifest existed) are re-documented once,
+    since what they were generated from is unknown.
     """
     for root, dirs, files in os.walk(input_dir_path):
         # Determine the path in the output directory
@@ -198,15 +649,171 @@ def process_source_dir(input_dir_path, output_dir_path):
             os.makedirs(output_root)
 
         for file in files:
+            input_file_path = os.path.join(root, file)
+            output_file_path = os.path.join(output_root, file)
             if file.endswith('.h'):  # Process C++ header files
-                input_file_path = os.path.join(root, file)
-                output_file_path = os.path.join(output_root, file)
-                if not os.path.exists(output_file_path):
-                    process_cpp_file(input_file_path, output_file_path)
+                rel_path = os.path.relpath(input_file_path, input_dir_path)
+                if not is_up_to_date(manifest.get(rel_path), input_file_path, output_file_path, mode):
+                    yield input_file_path, output_file_path, rel_path
             else:
                 # Copy other files to the output directory
-                shutil.copy(os.path.join(root, file), output_root)
-    
+                copy_if_changed(input_file_path, output_file_path)
+
+def process_source_dir(input_dir_path, output_dir_path, stream=False, mode='full'):
+    """
+    Recursively process all C++ header files in a directory, adding Doxygen comments to them.
+    Save the processed files to the output directory (preserving the directory structure).
+    Only headers that changed since the last run (or whose prompt/model changed) are re-documented.
+    """
+    manifest = load_manifest(output_dir_path)
+    try:
+        for input_file_path, output_file_path, rel_path in walk_source_dir(input_dir_path, output_dir_path, manifest,
+                                                                           mode):
+            if process_cpp_file(input_file_path, output_file_path, stream, mode):
+                manifest[rel_path] = manifest_entry(input_file_path, output_file_path, mode)
+    finally:
+        save_manifest(output_dir_path, manifest)
+
+async def process_source_dir_async(input_dir_path, output_dir_path, concurrency=8, stream=False, mode='full'):
+    """
+    Same as process_source_dir, but documents many headers concurrently
+    with at most `concurrency` API requests in flight.
+    """
+    client = get_async_client()
+    semaphore = asyncio.Semaphore(concurrency)
+    manifest = load_manifest(output_dir_path)
+
+    async def process(input_file_path, output_file_path, rel_path):
+        if await process_cpp_file_async(input_file_path, output_file_path, client, semaphore, stream, mode):
+            manifest[rel_path] = manifest_entry(input_file_path, output_file_path, mode)
+
+    try:
+        tasks = [process(*paths) for paths in walk_source_dir(input_dir_path, output_dir_path, manifest, mode)]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Error: {result}")
+    finally:
+        save_manifest(output_dir_path, manifest)
+
+def process_cpp_files_batch(file_paths, batch_path, poll_interval=POLL_INTERVAL):
+    """
+    Batch API version of process_cpp_file for many (input, output) files at once.
+    The chunks of all files are submitted as one batch job; chunks whose answer ends with
+    '//continue' get their continuation request in the next round, so a run takes at most
+    MAX_CONTINUE_ITER + 1 batch jobs. Returns the list of the files that were documented.
+    """
+    chunks = {}  # custom id -> code chunk
+    file_chunk_ids = []
+    for file_num, (input_file_path, output_file_path) in enumerate(file_paths):
+        print(input_file_path)
+        with open(input_file_path, 'r') as file:
+            cpp_code = file.read()
+        ids = []
+        for chunk_num, code_chunk in enumerate(split_code(cpp_code)):
+            ids.append(f"{file_num}-{chunk_num}")
+            chunks[ids[-1]] = code_chunk
+        file_chunk_ids.append(ids)
+
+    chat_histories = {custom_id: multi_chat_history(code_chunk)
+                      for custom_id, code_chunk in chunks.items() if has_declarations(code_chunk)}
+    doc_lines = {custom_id: [] for custom_id in chat_histories}
+    starts = {custom_id: 0 for custom_id in chat_histories}
+    failed = set()
+    pending = list(chat_histories)
+    stem, ext = os.path.splitext(batch_path)
+    for iter in range(MAX_CONTINUE_ITER + 1):
+        if not pending:
+            break
+        requests = {custom_id: dict(model=MODEL, messages=chat_histories[custom_id], temperature=1,
+                                    max_tokens=4095, top_p=1, frequency_penalty=0, presence_penalty=0)
+                    for custom_id in pending}
+        results = run_batch(requests, f"{stem}.{iter}{ext}", poll_interval=poll_interval,
+                            label='doxygen' if iter == 0 else 'doxygen-continue')
+        continued = []
+        for custom_id in pending:
+            result = results.get(custom_id)
+            # if finish_reason is not 'stop', report error and give up on the chunk
+            if result is None or result.finish_reason != 'stop':
+                print(f"Error: GPT failed to finish the task (chunk {custom_id}).")
+                failed.add(custom_id)
+                continue
+            code_lines = chunks[custom_id].split('\n')
+            doc_lines[custom_id], end, finished = fold_response(code_lines, doc_lines[custom_id],
+                                                                starts[custom_id], result.content)
+            if finished:
+                continue
+            # no progress, or too many rounds
+            if end == starts[custom_id] or iter == MAX_CONTINUE_ITER:
+                print(f"Error: GPT failed to finish the task (chunk {custom_id}).")
+                failed.add(custom_id)
+                continue
+            starts[custom_id] = end
+            chat_histories[custom_id] = continuation_chat_history(code_lines, end, doc_lines[custom_id])
+            continued.append(custom_id)
+        pending = continued
+
+    documented = []
+    for (input_file_path, output_file_path), ids in zip(file_paths, file_chunk_ids):
+        if failed.intersection(ids):
+            continue
+        doc_chunks = [restore_blank_lines(chunks[custom_id], '\n'.join(doc_lines[custom_id]))
+                      if custom_id in doc_lines else chunks[custom_id] for custom_id in ids]
+        with open(output_file_path, 'w') as file:
+            file.write(''.join(doc_chunks))
+        documented.append((input_file_path, output_file_path))
+    return documented
+
+def process_cpp_files_batch_patch(file_paths, batch_path, poll_interval=POLL_INTERVAL, undocumented=False):
+    """
+    Batch API version of process_cpp_file in the 'patch' (or, with undocumented, 'undocumented') mode:
+    the insertion-patch requests of all files go into one batch job.
+    Returns the list of the files that were documented.
+    """
+    requests = {}
+    file_ranges = []
+    for file_num, (input_file_path, output_file_path) in enumerate(file_paths):
+        print(input_file_path)
+        with open(input_file_path, 'r') as file:
+            file_requests = patch_requests(file.read(), undocumented)
+        for chunk_num, request in enumerate(file_requests):
+            requests[f"{file_num}-{chunk_num}"] = request
+        file_ranges.append(len(file_requests))
+    label = 'doxygen-undocumented' if undocumented else 'doxygen-patch'
+    results = run_batch(requests, batch_path, poll_interval=poll_interval, label=label) if requests else {}
+
+    documented = []
+    for file_num, ((input_file_path, output_file_path), n_chunks) in enumerate(zip(file_paths, file_ranges)):
+        patches = [read_patch(results.get(f"{file_num}-{chunk_num}")) for chunk_num in range(n_chunks)]
+        if any(comments is None for comments in patches):
+            continue
+        with open(input_file_path, 'r') as file:
+            cpp_code = file.read()
+        with open(output_file_path, 'w') as file:
+            file.write(splice_comments(cpp_code, [comment for comments in patches for comment in comments]))
+        documented.append((input_file_path, output_file_path))
+    return documented
+
+def process_source_dir_batch(input_dir_path, output_dir_path, poll_interval=POLL_INTERVAL, mode='full'):
+    """
+    Same as process_source_dir, but documents all changed headers through the Batch API.
+    """
+    manifest = load_manifest(output_dir_path)
+    try:
+        jobs = list(walk_source_dir(input_dir_path, output_dir_path, manifest, mode))
+        rel_paths = {input_file_path: rel_path for input_file_path, _, rel_path in jobs}
+        file_paths = [(input_file_path, output_file_path) for input_file_path, output_file_path, _ in jobs]
+        batch_path = os.path.join(output_dir_path, '.doxygen_batch.jsonl')
+        if mode == 'full':
+            documented = process_cpp_files_batch(file_paths, batch_path, poll_interval)
+        else:
+            documented = process_cpp_files_batch_patch(file_paths, batch_path, poll_interval,
+                                                       undocumented=mode == 'undocumented')
+        for input_file_path, output_file_path in documented:
+            manifest[rel_paths[input_file_path]] = manifest_entry(input_file_path, output_file_path, mode)
+    finally:
+        save_manifest(output_dir_path, manifest)
+
 
 def main():
     parser = argparse.ArgumentParser(description="Generate doxygen documentation for C++ header.")
@@ -219,13 +826,67 @@ def main():
                         '--out_path',
                         type=str,
                         help='output path')
+    # optional argument: number of concurrent requests
+    parser.add_argument('-j',
+                        '--concurrency',
+                        type=int,
+                        default=1,
+                        help='maximum number of API requests in flight')
+    # optional argument: disable the response cache
+    parser.add_argument('--no-cache',
+                        action='store_true',
+                        help='do not reuse (or store) cached responses of earlier runs')
+    # optional arguments: rate limits of the API key (learned from response headers if not given)
+    parser.add_argument('--rpm',
+                        type=float,
+                        help='requests-per-minute limit')
+    parser.add_argument('--tpm',
+                        type=float,
+                        help='tokens-per-minute limit')
+    # optional argument: stream the responses
+    parser.add_argument('--stream',
+                        action='store_true',
+                        help='stream the responses (into OUTPUT.part when -j is 1) and report tokens/s')
+    # optional argument: per-call metrics file
+    parser.add_argument('--metrics-file',
+                        type=str,
+                        help='append per-call metrics (latency, tokens, retries, cache hits) as JSON lines')
+    # optional argument: submit all requests as Batch API jobs
+    parser.add_argument('--batch',
+                        action='store_true',
+                        help='submit the requests as Batch API jobs and wait for them (lower cost, higher latency)')
+    parser.add_argument('--poll-interval',
+                        type=float,
+                        default=POLL_INTERVAL,
+                        help='seconds between batch status checks')
+    # optional argument: request only the comments, as insertion patches
+    parser.add_argument('--patch',
+                        action='store_true',
+                        help='request only the comments (as JSON insertion patches) and splice them into the '
+                             'unchanged source')
+    # optional argument: document only the declarations that have no Doxygen comment yet
+    parser.add_argument('--undocumented',
+                        action='store_true',
+                        help='send only the declarations without a Doxygen comment (with a few lines of context) '
+                             'and splice the comments written for them into the unchanged source')
     args = parser.parse_args()
+    mode = 'undocumented' if args.undocumented else 'patch' if args.patch else 'full'
+    configure_client_pool(args.concurrency)
+    configure_cache(enabled=not args.no_cache)
+    configure_rate_limiter(args.rpm, args.tpm)
+    configure_metrics(args.metrics_file)
 
     if os.path.isdir(args.in_path):
         # Process all C++ header files in the directory
         input_dir_path = args.in_path
         output_dir_path = args.out_path if args.out_path else input_dir_path + "_doxygen"
-        process_source_dir(input_dir_path, output_dir_path)
+        if args.batch:
+            process_source_dir_batch(input_dir_path, output_dir_path, args.poll_interval, mode)
+        elif args.concurrency > 1:
+            asyncio.run(process_source_dir_async(input_dir_path, output_dir_path, args.concurrency, args.stream,
+                                                 mode))
+        else:
+            process_source_dir(input_dir_path, output_dir_path, args.stream, mode)
     elif os.path.isfile(args.in_path):
         # Process a single C++ header file
         input_cpp_file = args.in_path
@@ -233,9 +894,20 @@ def main():
             print("Error: input file is not a C++ header file.")
             return
         output_cpp_file = args.out_path if args.out_path else input_cpp_file.replace(".h", "_doxygen.h")
-        process_cpp_file(input_cpp_file, output_cpp_file)
+        if args.batch and mode == 'full':
+            process_cpp_files_batch([(input_cpp_file, output_cpp_file)], output_cpp_file + '.batch.jsonl',
+                                    args.poll_interval)
+        elif args.batch:
+            process_cpp_files_batch_patch([(input_cpp_file, output_cpp_file)], output_cpp_file + '.batch.jsonl',
+                                          args.poll_interval, undocumented=mode == 'undocumented')
+        elif args.concurrency > 1:
+            asyncio.run(process_cpp_file_async(input_cpp_file, output_cpp_file, get_async_client(),
+                                               asyncio.Semaphore(args.concurrency), args.stream, mode))
+        else:
+            process_cpp_file(input_cpp_file, output_cpp_file, args.stream, mode)
     else:
         print("Error: input path is neither a file nor a directory.")
+    print_summary()
 
 
 if __name__ == "__main__":
@@ -1,3 +1,4 @@
+import bisect
 import re
 
 def clean_code(code_content):
@@ -25,19 +26,539 @@ def clean_code(code_content):
 
     return code_content
 
+def mask_code(code_content, spans=None):
+    """
+    Blank out comments, string/character literals and preprocessor lines, keeping offsets and newlines intact.
+    The result only contains C++ code, so braces and keywords found in it are real.
+
+    :param code_content: String containing the code content.
+    :param spans: Optional list to which the (start, end) offsets of every blanked piece are appended.
+    :return: A tuple (masked code, list of offsets just after each preprocessor line).
+    """
+    masked = list(code_content)
+    preprocessor_ends = []
+    n = len(code_content)
+    i = 0
+    line_start = True  # only whitespace seen since the last newline
+
+    def blank(start, end):
+        if spans is not None:
+            spans.append((start, end))
+        for k in range(start, end):
+            if masked[k] != '\n':
+                masked[k] = ' '
+
+    while i < n:
+        c = code_content[i]
+        if c == '\n':
+            line_start = True
+            i += 1
+        elif c in ' \t\r\f\v':
+            i += 1
+        elif c == '#' and line_start:
+            # Preprocessor directive, possibly continued with backslashes
+            end = i
+            while True:
+                end = code_content.find('\n', end)
+                if end == -1:
+                    end = n
+                    break
+                if code_content[end - 1] != '\\':
+                    break
+                end += 1
+            blank(i, end)
+            preprocessor_ends.append(min(end + 1, n))
+            i = end
+        elif code_content.startswith('//', i):
+            end = code_content.find('\n', i)
+            end = n if end == -1 else end
+            blank(i, end)
+            i = end
+        elif code_content.startswith('/*', i):
+            end = code_content.find('*/', i + 2)
+            end = n if end == -1 else end + 2
+            blank(i, end)
+            line_start = False
+            i = end
+        elif c == 'R' and code_content.startswith('"', i + 1):
+            # Raw string literal: R"delim( ... )delim"
+            paren = code_content.find('(', i + 2)
+            delim = code_content[i + 2:paren] if paren != -1 else ''
+            end = code_content.find(')' + delim + '"', paren + 1) if paren != -1 else -1
+            end = n if end == -1 else end + len(delim) + 2
+            blank(i + 1, end)
+            line_start = False
+            i = end
+        elif c == '"' or (c == "'" and not (i > 0 and code_content[i - 1].isalnum()
+                                          and i + 1 < n and code_content[i + 1].isalnum()
+                                          and code_content[i - 1].isdigit())):
+            # String or character literal (but not a digit separator such as 1'000)
+            end = i + 1
+            while end < n and code_content[end] != c and code_content[end] != '\n':
+                end += 2 if code_content[end] == '\\' else 1
+            end = min(end + 1, n)
+            blank(i, end)
+            line_start = False
+            i = end
+        else:
+            line_start = False
+            i += 1
+
+    return ''.join(masked), preprocessor_ends
+
+def _strip_template_header(head):
+    """
+    Remove a leading 'template <...>' parameter list from a declaration head.
+    """
+    match = re.match(r'\s*template\s*<', head)
+    if not match:
+        return head
+    depth = 1
+    for k in range(match.end(), len(head)):
+        if head[k] == '<':
+            depth += 1
+        elif head[k] == '>':
+            depth -= 1
+            if depth == 0:
+                return _strip_template_header(head[k + 1:])
+    return head
+
+def _line_end(code_content, pos):
+    """
+    Extend a boundary to the end of its line if only whitespace or a comment follows on that line.
+    """
+    end = code_content.find('\n', pos)
+    end = len(code_content) if end == -1 else end + 1
+    rest = code_content[pos:end].strip()
+    if not rest or rest.startswith('//') or (rest.startswith('/*') and rest.endswith('*/')):
+        return end
+    return pos
+
+# First non-space character from a position on
+_NEXT_CHAR_RE = re.compile(r'\s*(\S)')
+
+def find_declaration_boundaries(code_content):
+    """
+    Find the offsets at which top-level declarations end.
+    Declarations inside namespaces (and extern "C" blocks) count as top-level, so a namespace
+    can be cut between its members; classes, functions and enums are never cut.
+
+    :param code_content: String containing the entire code content.
+    :return: A sorted list of offsets; cutting the code at these offsets keeps every declaration whole.
+    """
+    masked, preprocessor_ends = mask_code(code_content)
+    boundaries = []
+    stack = []  # kinds of the open braces: 'scope' (namespace / extern) or 'block'
+    stmt_start = 0
+    block_head = ''
+    n = len(masked)
+
+    def at_top_level():
+        return all(kind == 'scope' for kind in stack)
+
+    for end in preprocessor_ends:
+        # Preprocessor lines at top level (include guards, includes, macros) are boundaries too
+        boundaries.append(end)
+
+    for i, c in enumerate(masked):
+        if c == '{':
+            # The head is only needed (and only copied) at top level, so nested blocks cost nothing extra
+            head = masked[stmt_start:i] if at_top_level() else None
+            if head is not None and re.search(r'\bnamespace\b|\bextern\s*$', head):
+                stack.append('scope')
+                boundaries.append(_line_end(code_content, i + 1))
+                stmt_start = i + 1
+            else:
+                if head is not None:
+                    block_head = head
+                stack.append('block')
+        elif c == '}':
+            kind = stack.pop() if stack else 'scope'
+            if not at_top_level():
+                continue
+            if kind == 'scope':
+                boundaries.append(_line_end(code_content, i + 1))
+                stmt_start = i + 1
+                continue
+            # A class/struct/union/enum definition ends at the following ';', a function body right here
+            following = _NEXT_CHAR_RE.match(masked, i + 1)
+            following = following.group(1) if following else ''
+            is_type = re.search(r'\b(class|struct|union|enum)\b', _strip_template_header(block_head))
+            if following != ';' and not (is_type and re.match(r'[A-Za-z_*&]', following)):
+                boundaries.append(_line_end(code_content, i + 1))
+                stmt_start = i + 1
+        elif c == ';' and at_top_level():
+            boundaries.append(_line_end(code_content, i + 1))
+            stmt_start = i + 1
+
+    return sorted(set(b for b in boundaries if 0 < b < n))
+
+# Matches a function declarator: a name directly followed by its parameter list
+_FUNCTION_RE = re.compile(r'[\w~>\]]\s*\(')
+_ACCESS_RE = re.compile(r'\b(public|private|protected|signals|slots)\s*:(?!:)')
+_SKIPPED_RE = re.compile(r'^\s*(using|typedef|friend|static_assert|template\s+(class|struct)\s+\w)\b')
+
+def _strip_template_arguments(statement):
+    """
+    Blank out template argument lists (e.g. std::function<void(int)>), which may contain parentheses.
+    """
+    result = list(statement)
+    depth = 0
+    for k, c in enumerate(statement):
+        if c == '<' and (depth > 0 or re.match(r'[\w:]', statement[k - 1:k])):
+            depth += 1
+        elif c == '>' and depth > 0:
+            depth -= 1
+            result[k] = ' '
+        if depth > 0:
+            result[k] = ' '
+    # An unbalanced '<' was a comparison, not a template argument list
+    return statement if depth > 0 else ''.join(result)
+
+def _is_function(statement):
+    """
+    Check whether a declaration statement declares a function (rather than a variable).
+    """
+    if re.search(r'\boperator\b', statement):
+        return '=' not in statement[:statement.index('operator')]
+    statement = _strip_template_arguments(statement)
+    match = _FUNCTION_RE.search(statement)
+    return bool(match) and '=' not in statement[:match.start()]
+
+def _blank_access(statement):
+    """
+    Blank out access specifiers (public:, private:, ...), keeping offsets intact.
+    """
+    return _ACCESS_RE.sub(lambda match: ' ' * len(match.group()), statement)
+
+def find_declarations(code_content):
+    """
+    Find the objects (classes, functions, variables) that need to be documented in the code.
+    The code is scanned once with a lightweight lexer (see mask_code), without parsing C++.
+    :param code_content: String containing the code content.
+    :return: A list of (kind, start, end) tuples in code order: kind is one of the keys of count_object,
+             start the offset of the declaration (its template header included) and end the offset
+             just after its head (the ';' or '{' ending it, or the end of an enumerator).
+    """
+    declarations = []
+    masked, _ = mask_code(code_content)
+    stack = []  # 'scope' (namespace / extern), 'class', 'enum', 'init' (brace initializer) or 'body'
+    stmt_start = 0
+
+    def context():
+        return stack[-1] if stack else 'scope'
+
+    def start_of(statement, offset):
+        return offset + len(statement) - len(statement.lstrip())
+
+    def declare(statement, offset, end):
+        if not statement.strip() or _SKIPPED_RE.match(statement.strip()):
+            return
+        if _is_function(statement):
+            declarations.append(('methods' if context() == 'class' else 'functions', start_of(statement, offset), end))
+        elif not re.match(r'^(template\s*<.*>\s*)?(class|struct|union|enum)\b[^{]*$', statement.strip(), re.S):
+            # not a forward declaration
+            declarations.append(('members', start_of(statement, offset), end))
+
+    for i, c in enumerate(masked):
+        if c == '{':
+            if context() in ('enum', 'init', 'body'):
+                stack.append('body')
+                continue
+            head = _blank_access(masked[stmt_start:i])
+            type_head = _strip_template_header(head)
+            if re.search(r'\bnamespace\b|\bextern\s*$', head):
+                stack.append('scope')
+            elif re.search(r'\benum\b', type_head):
+                declarations.append(('enums', start_of(head, stmt_start), i + 1))
+                stack.append('enum')
+            elif re.search(r'\b(class|struct|union)\b', type_head) and '(' not in type_head:
+                declarations.append(('classes', start_of(head, stmt_start), i + 1))
+                stack.append('class')
+            elif _is_function(head) and not re.search(r'\)\s*:(?!:)([^;]*,)?\s*[\w:<>]+\s*$', head):
+                # Function definition (a brace in a constructor's member initializer list is an initializer)
+                declarations.append(('methods' if context() == 'class' else 'functions',
+                                     start_of(head, stmt_start), i + 1))
+                stack.append('body')
+            else:
+                stack.append('init')
+                continue
+            stmt_start = i + 1
+        elif c == '}':
+            kind = stack.pop() if stack else 'scope'
+            if kind == 'enum':
+                offset = stmt_start
+                for item in masked[stmt_start:i].split(','):
+                    if item.strip():
+                        declarations.append(('members', start_of(item, offset), offset + len(item.rstrip())))
+                    offset += len(item) + 1
+            if kind != 'init' and context() in ('scope', 'class'):
+                stmt_start = i + 1
+        elif c == ';' and context() in ('scope', 'class'):
+            declare(_blank_access(masked[stmt_start:i]), stmt_start, i + 1)
+            stmt_start = i + 1
+
+    return sorted(declarations, key=lambda declaration: declaration[1])
+
+def has_declarations(code_chunk):
+    """
+    Check whether the code chunk declares anything that needs documentation (see find_declarations).
+    Chunks that do not (include guards and includes, the closing braces of a namespace, ...) are kept as they are.
+    :param code_chunk: String containing the code chunk.
+    :return: True if the chunk has at least one class, function, enum or variable declaration.
+    """
+    return bool(find_declarations(code_chunk))
+
 def count_object(code_chunk):
     """
     Count the number of objects (classes, functions, variables) that need to be documented in the code chunk.
+    The chunk is scanned once with a lightweight lexer (see find_declarations), without parsing C++.
     :param code_chunk: String containing the code chunk.
-    :return: A dictionary containing the number of objects of each type.
+    :return: A dictionary containing the number of objects of each type:
+             'classes' (classes, structs and unions), 'methods', 'functions' (free functions),
+             'enums' and 'members' (data members, enumerators and namespace-scope variables).
     """
-    pass
-    
-def split_code(code_content, token_limit=4095):
+    counts = {'classes': 0, 'methods': 0, 'functions': 0, 'enums': 0, 'members': 0}
+    for kind, _, _ in find_declarations(code_chunk):
+        counts[kind] += 1
+    return counts
+
+def estimate_tokens(text):
+    """
+    Rough token count of a text (about 4 characters per token for code), without needing a tokenizer.
+
+    :param text: String containing the text.
+    :return: Estimated number of tokens.
+    """
+    return len(text) // 4 + 1
+
+# Typical number of tokens of the Doxygen comment written for each kind of object
+DOC_TOKENS_PER_OBJECT = {'classes': 60, 'methods': 45, 'functions': 60, 'enums': 30, 'members': 12}
+
+def estimate_output_tokens(code_chunk):
+    """
+    Predict the number of tokens of the documented code chunk: the code itself plus the Doxygen comments
+    expected for the objects it contains.
+
+    :param code_chunk: String containing the code chunk.
+    :return: Estimated number of output tokens.
+    """
+    counts = count_object(code_chunk)
+    return estimate_tokens(code_chunk) + sum(DOC_TOKENS_PER_OBJECT[kind] * n for kind, n in counts.items())
+
+# Tokens of the JSON around each comment of an insertion patch ({"line": ..., "symbol": ..., "comment": ...})
+PATCH_TOKENS_PER_OBJECT = 15
+
+def estimate_patch_tokens(code_chunk):
+    """
+    Predict the number of tokens of an insertion patch for the code chunk: only the Doxygen comments
+    expected for its objects, each with its line number and symbol, without the code.
+
+    :param code_chunk: String containing the code chunk.
+    :return: Estimated number of output tokens.
+    """
+    counts = count_object(code_chunk)
+    return sum((DOC_TOKENS_PER_OBJECT[kind] + PATCH_TOKENS_PER_OBJECT) * n for kind, n in counts.items()) + 1
+
+def split_code(code_content, token_limit=4095, estimate=estimate_output_tokens):
     """
     Split the code into chunks such that each chunk is more managable by GPTs.
+    Chunks are cut at top-level declaration boundaries (between namespace members, classes and free functions),
+    so each chunk can be documented by an independent request. Concatenating the chunks gives back the code.
+    Chunks are sized with the estimate of their output (estimate_output_tokens, or estimate_patch_tokens
+    when only the comments are returned), so that it fits in the limit; a single declaration larger than
+    the limit becomes a chunk on its own.
     :param code_content: String containing the entire code content.
     :param token_limit: Maximum number of output tokens allowed by GPTs.
+    :param estimate: Function estimating the output tokens of a piece of code.
     :return: A list of code chunks.
     """
-    pass
\ No newline at end of file
+    chunks = []
+    chunk_start = 0
+    chunk_tokens = 0
+    segment_start = 0
+    for boundary in find_declaration_boundaries(code_content) + [len(code_content)]:
+        # Declarations are estimated separately, so the cost of splitting is linear in the code size
+        segment_tokens = estimate(code_content[segment_start:boundary])
+        if segment_start > chunk_start and chunk_tokens + segment_tokens > token_limit:
+            chunks.append(code_content[chunk_start:segment_start])
+            chunk_start = segment_start
+            chunk_tokens = 0
+        chunk_tokens += segment_tokens
+        segment_start = boundary
+    if chunk_start < len(code_content):
+        chunks.append(code_content[chunk_start:])
+    return chunks
+
+# Start of a Doxygen comment line: ///, //!, /** or /*!
+_DOC_COMMENT_RE = re.compile(r'^\s*(///|//!|/\*\*|/\*!)')
+_TEMPLATE_RE = re.compile(r'^\s*template\s*<')
+
+# Lines searched above a declaration for its template header
+MAX_TEMPLATE_LINES = 10
+
+def declaration_start(code_lines, index):
+    """
+    Move a declaration line up over the 'template <...>' header lines above it, where its comment belongs.
+
+    :param code_lines: List of the lines of the code.
+    :param index: 0-based index of the line.
+    :return: 0-based index of the first line of the declaration.
+    """
+    start = index
+    for k in range(index - 1, max(index - 1 - MAX_TEMPLATE_LINES, -1), -1):
+        # Lines k..index-1 must be nothing but (possibly nested) template headers
+        if _TEMPLATE_RE.match(code_lines[k]) and not _strip_template_header('\n'.join(code_lines[k:index])).strip():
+            start = k
+    return start
+
+def has_doc_comment(code_lines, index):
+    """
+    Check whether the declaration on the line at index (its template header included) is directly
+    preceded, blank lines aside, by a Doxygen comment.
+
+    :param code_lines: List of the lines of the code.
+    :param index: 0-based index of the line.
+    :return: True if a '///', '//!' or '/** ... */' comment ends right above the declaration.
+    """
+    k = declaration_start(code_lines, index) - 1
+    while k >= 0 and not code_lines[k].strip():
+        k -= 1
+    if k < 0:
+        return False
+    line = code_lines[k].strip()
+    if _DOC_COMMENT_RE.match(line):
+        return True
+    if line.endswith('*/'):
+        # Find the start of the block comment
+        while k >= 0 and '/*' not in code_lines[k]:
+            k -= 1
+        return k >= 0 and bool(re.search(r'/\*[*!](?!<)', code_lines[k]))
+    return False
+
+# A Doxygen comment documenting the member before it: ///<, //!<, /**< or /*!<
+_TRAILING_DOC_COMMENT_RE = re.compile(r'(///|//!|/\*\*|/\*!)<')
+
+def find_undocumented(code_content):
+    """
+    Find the declarations that have no Doxygen comment, neither above them nor trailing on their lines
+    ('///<' and the like). Declarations sharing a line (such as the enumerators of a one-line enum)
+    are reported once, as the first of them.
+
+    :param code_content: String containing the code content.
+    :return: A tuple (list of (kind, first line, last line) of the undocumented declarations, with the
+             0-based lines of their heads, number of declarations found).
+    """
+    code_lines = code_content.split('\n')
+    line_starts = [0]
+    for line in code_lines[:-1]:
+        line_starts.append(line_starts[-1] + len(line) + 1)
+
+    declarations = find_declarations(code_content)
+    undocumented = []
+    seen = set()
+    for kind, start, end in declarations:
+        first = bisect.bisect_right(line_starts, start) - 1
+        last = bisect.bisect_right(line_starts, max(end - 1, start)) - 1
+        if first in seen:
+            continue
+        seen.add(first)
+        if has_doc_comment(code_lines, first) \
+                or any(_TRAILING_DOC_COMMENT_RE.search(line) for line in code_lines[first:last + 1]):
+            continue
+        undocumented.append((kind, first, last))
+    return undocumented, len(declarations)
+
+_TRAILING_BACKSLASH_RE = re.compile(r'[\s\\]*\\[\s\\]*$')
+
+def comment_lines(comment):
+    """
+    Normalize a comment returned by the model into the lines to insert (without indentation).
+    Text that is not a well-formed comment is turned into '///' lines, so that inserting it never changes the code.
+
+    :param comment: String containing the comment.
+    :return: A list of comment lines.
+    """
+    lines = [line.strip() for line in comment.strip().split('\n')]
+    text = '\n'.join(lines)
+    if lines[0].startswith('/*') and text.endswith('*/') and '*/' not in text[2:-2]:
+        # Block comment: continuation lines starting with '*' are aligned under the first '*'
+        return [lines[0]] + [' ' + line if line.startswith('*') else line for line in lines[1:]]
+    # A '//' line ending in a backslash would continue onto the code below it
+    lines = [_TRAILING_BACKSLASH_RE.sub('', line) for line in lines]
+    if all(line.startswith('//') for line in lines):
+        return lines
+    return ['/// ' + line if line else '///' for line in lines]
+
+def _find_symbol_line(code_lines, symbol, index):
+    """
+    Find the line closest to index on which symbol is declared (-1 if it appears nowhere).
+    """
+    name = re.split(r'\s*\(', symbol.strip())[0].split('::')[-1].strip()
+    if not name:
+        return -1
+    pattern = re.compile(r'(?<![\w])' + re.escape(name) + r'(?!\w)')
+    found = [k for k, line in enumerate(code_lines) if pattern.search(line)]
+    return min(found, key=lambda k: abs(k - index)) if found else -1
+
+def find_enclosed_lines(code_content):
+    """
+    Find the lines that start inside a comment, a literal or a preprocessor directive continued from the
+    line above, where inserting a line would change the code.
+
+    :param code_content: String containing the code content.
+    :return: A set of 0-based line indices.
+    """
+    spans = []
+    mask_code(code_content, spans)
+    newlines = [k for k, c in enumerate(code_content) if c == '\n']
+    enclosed = set()
+    for start, end in spans:
+        # Every newline inside a blanked piece starts an enclosed line
+        first = bisect.bisect_left(newlines, start)
+        last = bisect.bisect_left(newlines, end)
+        enclosed.update(k + 1 for k in range(first, last))
+    code_lines = code_content.split('\n')
+    enclosed.update(k + 1 for k, line in enumerate(code_lines[:-1]) if line.endswith('\\'))
+    return enclosed
+
+def splice_comments(code_content, patches):
+    """
+    Insert Doxygen comments into the code without changing any of its lines.
+    Each patch names the 1-based line the comment goes above and, optionally, the symbol declared there;
+    if the symbol is not on that line, the closest line that has it is used instead. Comments go above
+    the template header of the declaration, indented like its first line; declarations that already have
+    a Doxygen comment are left alone, and patches that cannot be placed (or would land inside a comment,
+    a literal or a continued macro) are skipped.
+
+    :param code_content: String containing the code.
+    :param patches: List of dictionaries with the keys 'line', 'comment' and optionally 'symbol'.
+    :return: The code with the comments inserted.
+    """
+    code_lines = code_content.split('\n')
+    enclosed = find_enclosed_lines(code_content)
+    insertions = {}  # 0-based line index -> comment lines
+    for patch in patches:
+        try:
+            index = int(patch.get('line', 0)) - 1
+        except (TypeError, ValueError):
+            index = -1
+        symbol = str(patch.get('symbol') or '')
+        on_line = 0 <= index < len(code_lines) and _find_symbol_line(code_lines[index:index + 1], symbol, 0) == 0
+        if symbol and not on_line:
+            index = _find_symbol_line(code_lines, symbol, index)
+        if 0 <= index < len(code_lines):
+            index = declaration_start(code_lines, index)
+        comment = str(patch.get('comment') or '').strip()
+        if not 0 <= index < len(code_lines) or not comment or index in insertions or index in enclosed \
+                or has_doc_comment(code_lines, index):
+            print(f"Skipped comment for line {patch.get('line')} ({symbol or 'no symbol'})")
+            continue
+        indent = code_lines[index][:len(code_lines[index]) - len(code_lines[index].lstrip())]
+        insertions[index] = [indent + line for line in comment_lines(comment)]
+
+    doc_lines = []
+    for index, line in enumerate(code_lines):
+        doc_lines.extend(insertions.get(index, []))
+        doc_lines.append(line)
+    return '\n'.join(doc_lines)
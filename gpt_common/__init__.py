@@ -0,0 +1,3 @@
+"""
+Helpers shared by the GPT-based scripts (pdf_cleaner, doc_writer).
+"""
@@ -0,0 +1,195 @@
+"""
+Batch API submission for offline bulk runs.
+
+run_batch() writes chat-completion requests to JSONL batch files, uploads and submits them
+as batch jobs, polls until they finish and maps the results back to the callers' custom ids.
+Batch jobs cost about half as much per token as interactive calls, at the price of a
+completion window of up to 24 hours.
+
+Requests already in the response cache are answered from it and not submitted; fresh
+results are cached like those of chat_completion(). The id of every submitted job is
+saved next to its batch file, so a poller that was killed picks the same job up again
+instead of paying for it twice.
+"""
+
+import hashlib
+import json
+import os
+import time
+from types import SimpleNamespace
+
+from gpt_common.cache import get_cache
+from gpt_common.chat import _lookup, _store
+from gpt_common.client import get_client
+from gpt_common.metrics import record_call, usage_tokens
+
+ENDPOINT = '/v1/chat/completions'
+COMPLETION_WINDOW = '24h'
+POLL_INTERVAL = 60.0  # seconds between status checks
+
+# Limits of a single batch job; larger runs are split into several jobs
+MAX_BATCH_REQUESTS = 50000
+MAX_BATCH_BYTES = 190 * 1024 * 1024
+
+FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+def _parse_body(body):
+    """Attribute access to a chat-completion body from a batch output file, as _store() expects."""
+    choices = [SimpleNamespace(message=SimpleNamespace(content=(choice.get('message') or {}).get('content')),
+                               finish_reason=choice.get('finish_reason'))
+               for choice in body.get('choices', [])]
+    return SimpleNamespace(choices=choices, usage=body.get('usage'))
+
+
+def batch_line(custom_id, model, messages, **params) -> str:
+    """One line of a batch input file."""
+    body = {'model': model, 'messages': messages, **params}
+    return json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': ENDPOINT, 'body': body},
+                      ensure_ascii=False) + '\n'
+
+
+def write_batch_files(lines, batch_path):
+    """Write batch lines to batch_path, starting a new part file whenever a job's limits are reached.
+
+    Returns the paths of the files written: batch_path, then batch_path with .1, .2, ... inserted
+    before the extension.
+    """
+    stem, ext = os.path.splitext(batch_path)
+    paths = []
+    out = None
+    count = size = 0
+    for line in lines:
+        line_size = len(line.encode('utf-8'))
+        if out is None or count == MAX_BATCH_REQUESTS or size + line_size > MAX_BATCH_BYTES:
+            if out is not None:
+                out.close()
+            paths.append(batch_path if not paths else f'{stem}.{len(paths)}{ext}')
+            out = open(paths[-1], 'w', encoding='utf-8')
+            count = size = 0
+        out.write(line)
+        count += 1
+        size += line_size
+    if out is not None:
+        out.close()
+    return paths
+
+
+def _state_path(path):
+    return path + '.id'
+
+
+def _file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def submit_batch(path, client=None) -> str:
+    """Upload a batch file and create a batch job for it; returns the job id.
+
+    If the same file was submitted before (by a run that did not live to collect the results),
+    the id of that job is returned instead.
+    """
+    client = client or get_client()
+    input_hash = _file_hash(path)
+    try:
+        with open(_state_path(path), 'r') as f:
+            state = json.load(f)
+        if state['input_hash'] == input_hash:
+            print(f"Resuming batch {state['batch_id']} for {path}")
+            return state['batch_id']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    with open(path, 'rb') as f:
+        input_file = client.files.create(file=f, purpose='batch')
+    batch = client.batches.create(input_file_id=input_file.id, endpoint=ENDPOINT,
+                                  completion_window=COMPLETION_WINDOW)
+    with open(_state_path(path), 'w') as f:
+        json.dump({'batch_id': batch.id, 'input_hash': input_hash}, f)
+    print(f"Submitted batch {batch.id} for {path}")
+    return batch.id
+
+
+def wait_for_batch(batch_id, client=None, poll_interval=POLL_INTERVAL):
+    """Poll a batch job until it reaches a final status; returns the batch object."""
+    client = client or get_client()
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in FINAL_STATUSES:
+            return batch
+        counts = batch.request_counts
+        progress = f" ({counts.completed + counts.failed}/{counts.total} requests)" if counts else ''
+        print(f"Batch {batch_id}: {batch.status}{progress}")
+        time.sleep(poll_interval)
+
+
+def read_batch_results(batch, client=None):
+    """Return the result lines of a finished batch job as {custom_id: line}, including failed requests."""
+    client = client or get_client()
+    results = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                results[entry['custom_id']] = entry
+    return results
+
+
+def _record(label, model, result=None, error=None):
+    input_tokens, output_tokens = usage_tokens(result.usage if result else None)
+    record_call(label=label, model=model, batch=True, cached=bool(result and result.cached),
+                input_tokens=input_tokens, output_tokens=output_tokens,
+                finish_reason=result.finish_reason if result else None, error=error)
+
+
+def run_batch(requests, batch_path, client=None, poll_interval=POLL_INTERVAL, label=None):
+    """Run chat-completion requests as batch jobs and wait for the results.
+
+    requests maps custom ids to dicts of chat_completion() arguments (model, messages, other
+    parameters). Returns {custom_id: ChatResult}; requests that failed are left out, so the
+    caller can retry them or fall back. Every request is recorded in gpt_common.metrics
+    under `label` (without timings, which only exist for the job as a whole).
+    """
+    client = client or get_client()
+    cache = get_cache()
+    results = {}
+    keys = {}
+    lines = []
+    for custom_id, request in requests.items():
+        request = dict(request)
+        model = request.pop('model')
+        messages = request.pop('messages')
+        key, result = _lookup(cache, model, messages, request)
+        if result is not None:
+            results[custom_id] = result
+            _record(label, model, result)
+            continue
+        keys[custom_id] = key
+        lines.append(batch_line(custom_id, model, messages, **request))
+    if not lines:
+        return results
+    print(f"{len(results)} requests answered from the cache, {len(lines)} submitted as a batch")
+
+    paths = write_batch_files(lines, batch_path)
+    batch_ids = [submit_batch(path, client) for path in paths]
+    for path, batch_id in zip(paths, batch_ids):
+        batch = wait_for_batch(batch_id, client, poll_interval)
+        if batch.status != 'completed':
+            print(f"Batch {batch_id} {batch.status}; its requests are reported as failed")
+        entries = read_batch_results(batch, client)
+        for custom_id, entry in entries.items():
+            response = entry.get('response') or {}
+            if entry.get('error') or response.get('status_code') != 200:
+                error = entry.get('error') or response.get('body', {}).get('error')
+                print(f"Batch request {custom_id} failed: {error}")
+                _record(label, requests[custom_id]['model'], error=str(error))
+                continue
+            results[custom_id] = _store(cache, keys[custom_id], _parse_body(response['body']))
+            _record(label, requests[custom_id]['model'], results[custom_id])
+        # The job is settled: a rerun has to submit whatever is still missing again
+        os.remove(_state_path(path))
+        os.remove(path)
+    return results
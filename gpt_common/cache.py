@@ -0,0 +1,98 @@
+"""
+On-disk, content-addressed cache of chat-completion responses.
+
+Entries are keyed by a hash of everything that determines the response (model,
+messages - hence system prompt and input text - and sampling parameters), so
+re-running a tool on a mostly-unchanged input only pays for the changed requests.
+The cache is bounded in size and evicts least-recently-used entries.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Optional
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'smart_scripts', 'responses')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class ResponseCache:
+    """Size-bounded LRU cache of JSON responses, one file per entry."""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._total_bytes = sum(entry.stat().st_size for entry in os.scandir(cache_dir)
+                                if entry.name.endswith('.json'))
+
+    @staticmethod
+    def key(**request) -> str:
+        """Hash of a request (model, messages, sampling parameters, ...)."""
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the cached value for key, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            os.utime(path)  # mark as recently used
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, value: dict):
+        """Store value under key, evicting old entries if the cache grows too large."""
+        data = json.dumps(value, ensure_ascii=False).encode('utf-8')
+        path = self._path(key)
+        # Write to a temp file and rename, so concurrent readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            try:
+                self._total_bytes -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(tmp_path, path)
+            self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Delete least-recently-used entries until the cache fits in max_bytes."""
+        entries = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith('.json')]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        self._total_bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._total_bytes -= size
+            except OSError:
+                pass
+
+
+_cache = None
+
+
+def configure_cache(enabled: bool = True, cache_dir: str = DEFAULT_CACHE_DIR,
+                    max_bytes: int = DEFAULT_MAX_BYTES):
+    """Enable (or disable) the process-wide response cache."""
+    global _cache
+    _cache = ResponseCache(cache_dir, max_bytes) if enabled else None
+
+
+def get_cache() -> Optional[ResponseCache]:
+    """Return the process-wide response cache, or None if caching is disabled."""
+    return _cache
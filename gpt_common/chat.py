@@ -0,0 +1,247 @@
+"""
+Chat-completion calls shared by the GPT-based scripts.
+
+chat_completion() / async_chat_completion() consult the response cache before calling
+the API and return a ChatResult instead of the raw response object, so callers work the
+same way whether the answer came from the API or from the cache. API calls go through
+the shared rate limiter and are retried with jittered exponential backoff on rate-limit,
+connection and server errors. With an on_delta callback the response is streamed and
+every piece of content is handed over as soon as it arrives. Every call is recorded in
+gpt_common.metrics.
+"""
+
+import asyncio
+import time
+from collections import namedtuple
+from types import SimpleNamespace
+
+import openai
+
+from gpt_common.cache import get_cache
+from gpt_common.client import get_client, get_async_client
+from gpt_common.metrics import record_call, usage_tokens
+from gpt_common.rate_limit import backoff_delay, get_rate_limiter, retry_after_seconds
+
+ChatResult = namedtuple('ChatResult', ['content', 'finish_reason', 'usage', 'cached'])
+
+MAX_RETRIES = 6
+
+# Errors worth retrying: the request may well succeed a little later
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def estimate_request_tokens(messages, params) -> int:
+    """Tokens a request counts against the budget: input (about 4 characters per token) plus max_tokens."""
+    input_chars = sum(len(message.get('content') or '') for message in messages)
+    return input_chars // 4 + params.get('max_tokens', 0)
+
+
+def _lookup(cache, model, messages, params):
+    if cache is None:
+        return None, None
+    key = cache.key(model=model, messages=messages, **params)
+    hit = cache.get(key)
+    if hit is not None:
+        return key, ChatResult(hit['content'], hit['finish_reason'], None, True)
+    return key, None
+
+
+def _store(cache, key, response) -> ChatResult:
+    choice = response.choices[0]
+    result = ChatResult(choice.message.content, choice.finish_reason, response.usage, False)
+    # Only complete answers are cached, so truncated or failed ones are retried next run
+    if cache is not None and result.finish_reason == 'stop':
+        cache.put(key, {'content': result.content, 'finish_reason': result.finish_reason})
+    return result
+
+
+class _StreamReader:
+    """Collects a streamed response, passing every piece of content on as it arrives."""
+
+    def __init__(self, on_delta, start):
+        self.on_delta = on_delta
+        self.parts = []
+        self.finish_reason = None
+        self.usage = None
+        self.start = start  # when the request was sent
+        self.first_token = None
+
+    def feed(self, chunk):
+        if chunk.usage:
+            self.usage = chunk.usage
+        for choice in chunk.choices:
+            if choice.delta.content:
+                if self.first_token is None:
+                    self.first_token = time.perf_counter()
+                self.parts.append(choice.delta.content)
+                self.on_delta(choice.delta.content)
+            if choice.finish_reason:
+                self.finish_reason = choice.finish_reason
+
+    def response(self):
+        """The collected response, shaped like a ChatCompletion for _store(); also reports the speed."""
+        elapsed = time.perf_counter() - self.start
+        tokens = self.usage.completion_tokens if self.usage else len(self.parts)  # about one token per piece
+        print(f"Streamed {tokens} tokens in {elapsed:.1f}s ({tokens / max(elapsed, 1e-6):.0f} tokens/s)")
+        message = SimpleNamespace(content=''.join(self.parts))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason=self.finish_reason)],
+                               usage=self.usage)
+
+
+class _CallMetrics:
+    """Times one chat_completion() call and records it in gpt_common.metrics."""
+
+    def __init__(self, model, label, queued_at):
+        self.model = model
+        self.label = label
+        self.start = queued_at if queued_at is not None else time.perf_counter()
+        self.first_sent = None
+        self.sent = None
+        self.retries = 0
+
+    def sending(self, attempt):
+        self.sent = time.perf_counter()
+        if self.first_sent is None:
+            self.first_sent = self.sent
+        self.retries = attempt
+        return self.sent
+
+    def record(self, result=None, error=None, first_token=None):
+        now = time.perf_counter()
+        input_tokens, output_tokens = usage_tokens(result.usage if result else None)
+        record_call(
+            label=self.label,
+            model=self.model,
+            cached=bool(result and result.cached),
+            # Time spent waiting for a turn: caller's queue, rate limiter (and nothing for cache hits)
+            queue_wait=(self.first_sent if self.first_sent is not None else now) - self.start,
+            latency=now - self.sent if self.sent is not None else None,
+            time_to_first_token=first_token - self.sent if first_token is not None else None,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            finish_reason=result.finish_reason if result else None,
+            retries=self.retries,
+            error=type(error).__name__ if error is not None else None,
+        )
+
+
+def _stream_params(on_delta):
+    return {'stream': True, 'stream_options': {'include_usage': True}} if on_delta is not None else {}
+
+
+def _retry_delay(error, attempt, limiter) -> float:
+    """Return how long to sleep before retrying a failed request.
+
+    After a 429 the rate limiter is paused instead, which holds back every caller
+    (including this one, in its next acquire), and 0 is returned.
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    delay = backoff_delay(attempt, retry_after_seconds(headers))
+    print(f"API error ({type(error).__name__}), retrying in {delay:.1f}s")
+    if isinstance(error, openai.RateLimitError) and limiter is not None:
+        limiter.update_from_headers(headers or {})
+        limiter.pause(delay)
+        return 0.0
+    return delay
+
+
+def chat_completion(model, messages, client=None, request_tokens=None, on_delta=None, label=None, queued_at=None,
+                    **params) -> ChatResult:
+    """Create a chat completion, served from the response cache when possible.
+
+    request_tokens is the estimate charged to the tokens-per-minute budget
+    (default: estimate_request_tokens). If on_delta is given, the response is streamed and
+    on_delta(text) is called with every piece of content as it arrives (with the whole
+    content at once for a cached answer). A failure after streaming has started is raised,
+    not retried, since part of the answer has already been handed over.
+
+    label names the call in the metrics; queued_at is the time.perf_counter() at which the
+    caller queued the work, so that its queue wait is measured as well.
+    """
+    metrics = _CallMetrics(model, label, queued_at)
+    cache = get_cache()
+    key, result = _lookup(cache, model, messages, params)
+    if result is not None:
+        if on_delta is not None:
+            on_delta(result.content)
+        metrics.record(result)
+        return result
+    client = client or get_client()
+    limiter = get_rate_limiter()
+    if request_tokens is None:
+        request_tokens = estimate_request_tokens(messages, params)
+    reader = None
+    try:
+        for attempt in range(MAX_RETRIES + 1):
+            if limiter is not None:
+                limiter.acquire(request_tokens)
+            try:
+                sent = metrics.sending(attempt)
+                raw_response = client.chat.completions.with_raw_response.create(model=model, messages=messages,
+                                                                                **_stream_params(on_delta), **params)
+                break
+            except RETRYABLE_ERRORS as e:
+                if attempt == MAX_RETRIES:
+                    raise
+                time.sleep(_retry_delay(e, attempt, limiter))
+        if limiter is not None:
+            limiter.update_from_headers(raw_response.headers)
+        response = raw_response.parse()
+        if on_delta is not None:
+            reader = _StreamReader(on_delta, sent)
+            for chunk in response:
+                reader.feed(chunk)
+            response = reader.response()
+        result = _store(cache, key, response)
+    except Exception as e:
+        metrics.record(error=e)
+        raise
+    metrics.record(result, first_token=reader.first_token if reader else None)
+    return result
+
+
+async def async_chat_completion(model, messages, client=None, request_tokens=None, on_delta=None, label=None,
+                                queued_at=None, **params) -> ChatResult:
+    """Async version of chat_completion."""
+    metrics = _CallMetrics(model, label, queued_at)
+    cache = get_cache()
+    key, result = _lookup(cache, model, messages, params)
+    if result is not None:
+        if on_delta is not None:
+            on_delta(result.content)
+        metrics.record(result)
+        return result
+    client = client or get_async_client()
+    limiter = get_rate_limiter()
+    if request_tokens is None:
+        request_tokens = estimate_request_tokens(messages, params)
+    reader = None
+    try:
+        for attempt in range(MAX_RETRIES + 1):
+            if limiter is not None:
+                await limiter.acquire_async(request_tokens)
+            try:
+                sent = metrics.sending(attempt)
+                raw_response = await client.chat.completions.with_raw_response.create(model=model,
+                                                                                      messages=messages,
+                                                                                      **_stream_params(on_delta),
+                                                                                      **params)
+                break
+            except RETRYABLE_ERRORS as e:
+                if attempt == MAX_RETRIES:
+                    raise
+                await asyncio.sleep(_retry_delay(e, attempt, limiter))
+        if limiter is not None:
+            limiter.update_from_headers(raw_response.headers)
+        response = raw_response.parse()
+        if on_delta is not None:
+            reader = _StreamReader(on_delta, sent)
+            async for chunk in response:
+                reader.feed(chunk)
+            response = reader.response()
+        result = _store(cache, key, response)
+    except Exception as e:
+        metrics.record(error=e)
+        raise
+    metrics.record(result, first_token=reader.first_token if reader else None)
+    return result
@@ -0,0 +1,58 @@
+"""
+Shared OpenAI clients.
+
+Every entry point gets its client from get_client() / get_async_client() instead of
+building a fresh OpenAI() per call, so HTTP keep-alive connections and TLS sessions
+are reused across requests. Point OPENAI_BASE_URL at a local server to run offline.
+The clients do not retry by themselves: gpt_common.chat retries in step with the rate limiter.
+"""
+
+import threading
+
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+DEFAULT_MAX_CONNECTIONS = 16
+KEEPALIVE_EXPIRY = 60.0  # seconds an idle connection is kept open
+
+_lock = threading.Lock()
+_max_connections = DEFAULT_MAX_CONNECTIONS
+_client = None
+_async_client = None
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=_max_connections,
+                        max_keepalive_connections=_max_connections,
+                        keepalive_expiry=KEEPALIVE_EXPIRY)
+
+
+def configure_client_pool(max_connections: int = DEFAULT_MAX_CONNECTIONS):
+    """Size the connection pool, e.g. to the number of concurrent requests.
+
+    Clients created before the call are dropped; the next get_client() builds a new one.
+    """
+    global _max_connections, _client, _async_client
+    with _lock:
+        _max_connections = max(1, max_connections)
+        _client = None
+        _async_client = None
+
+
+def get_client() -> OpenAI:
+    """Return the process-wide OpenAI client (thread-safe)."""
+    global _client
+    with _lock:
+        if _client is None:
+            _client = OpenAI(max_retries=0, http_client=DefaultHttpxClient(limits=_pool_limits()))
+        return _client
+
+
+def get_async_client() -> AsyncOpenAI:
+    """Return the process-wide AsyncOpenAI client."""
+    global _async_client
+    with _lock:
+        if _async_client is None:
+            _async_client = AsyncOpenAI(max_retries=0,
+                                        http_client=DefaultAsyncHttpxClient(limits=_pool_limits()))
+        return _async_client
@@ -0,0 +1,125 @@
+"""
+Per-call metrics of the chat-completion calls.
+
+gpt_common.chat records every call (queue wait, request latency, input/output tokens,
+finish_reason, retries, cache hits); callers record the requests they did not need to make
+(input used as is) with record_call(skipped=True). Records are written as JSON lines to the
+file given to configure_metrics(), and print_summary() reports percentiles and throughput at
+the end of a run, which is what concurrency sizing and cost forecasts are based on.
+"""
+
+import json
+import math
+import threading
+import time
+
+_lock = threading.Lock()
+_records = []
+_file = None
+
+
+def configure_metrics(path=None):
+    """Start a new run; with a path, every call is also appended to it as a JSON line."""
+    global _file
+    with _lock:
+        if _file is not None:
+            _file.close()
+        _file = open(path, 'a', encoding='utf-8') if path else None
+        _records.clear()
+
+
+def usage_tokens(usage):
+    """(input tokens, output tokens) of a response's usage, which may be an object, a dict or missing."""
+    if usage is None:
+        return None, None
+    if isinstance(usage, dict):
+        return usage.get('prompt_tokens'), usage.get('completion_tokens')
+    return usage.prompt_tokens, usage.completion_tokens
+
+
+def record_call(**fields):
+    """Record one call; fields: label, model, cached, skipped, queue_wait, latency, input_tokens, output_tokens, ..."""
+    record = {'time': round(time.time(), 3), **fields}
+    for key in ('queue_wait', 'latency', 'time_to_first_token'):
+        if record.get(key) is not None:
+            record[key] = round(record[key], 4)
+    with _lock:
+        _records.append(record)
+        if _file is not None:
+            _file.write(json.dumps(record) + '\n')
+            _file.flush()
+
+
+def get_records():
+    with _lock:
+        return list(_records)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile (q in 0..100) of a list of numbers."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))]
+
+
+def summarize(records=None):
+    """Aggregate call records: counts, token totals, latency and queue-wait percentiles, tokens/s."""
+    records = get_records() if records is None else records
+    skipped = sum(1 for r in records if r.get('skipped'))
+    records = [r for r in records if not r.get('skipped')]
+    api_calls = [r for r in records if not r.get('cached') and not r.get('error')]
+    latencies = [r['latency'] for r in api_calls if r.get('latency') is not None]
+    queue_waits = [r['queue_wait'] for r in records if r.get('queue_wait') is not None]
+    output_tokens = sum(r.get('output_tokens') or 0 for r in api_calls)
+    finish_reasons = {}
+    for r in api_calls:
+        finish_reasons[r.get('finish_reason')] = finish_reasons.get(r.get('finish_reason'), 0) + 1
+    summary = {
+        'calls': len(records),
+        'api_calls': len(api_calls),
+        'cache_hits': sum(1 for r in records if r.get('cached')),
+        'skipped': skipped,
+        'errors': sum(1 for r in records if r.get('error')),
+        'retries': sum(r.get('retries') or 0 for r in records),
+        'finish_reasons': finish_reasons,
+        'input_tokens': sum(r.get('input_tokens') or 0 for r in api_calls),
+        'output_tokens': output_tokens,
+        # Output speed of a single request, and of the run as a whole (requests overlap)
+        'output_tokens_per_request_second': output_tokens / sum(latencies) if sum(latencies) else None,
+    }
+    timed = [r for r in api_calls if r.get('latency') is not None]
+    if timed:
+        wall = max(r['time'] for r in timed) - min(r['time'] - r['latency'] for r in timed)
+        summary['output_tokens_per_second'] = output_tokens / wall if wall > 0 else None
+    for name, values in (('latency', latencies), ('queue_wait', queue_waits)):
+        for q in (50, 95, 99):
+            summary[f'{name}_p{q}'] = percentile(values, q)
+    return summary
+
+
+def print_summary(records=None):
+    """Print the summary of a run (nothing if no calls were made or skipped)."""
+    summary = summarize(records)
+    if not summary['calls'] and not summary['skipped']:
+        return
+
+    def seconds(value):
+        return f"{value:.2f}s" if value is not None else '-'
+
+    def rate(value):
+        return f"{value:.0f}" if value is not None else '-'
+
+    print(f"API metrics: {summary['calls']} calls ({summary['api_calls']} to the API, "
+          f"{summary['cache_hits']} cache hits, {summary['errors']} errors, {summary['retries']} retries)")
+    if summary['skipped']:
+        print(f"  skipped: {summary['skipped']} of {summary['skipped'] + summary['calls']} requests "
+              f"(input used as is)")
+    print(f"  tokens: {summary['input_tokens']} input, {summary['output_tokens']} output; "
+          f"finish reasons: {summary['finish_reasons']}")
+    print(f"  latency    p50 {seconds(summary['latency_p50'])}, p95 {seconds(summary['latency_p95'])}, "
+          f"p99 {seconds(summary['latency_p99'])}")
+    print(f"  queue wait p50 {seconds(summary['queue_wait_p50'])}, p95 {seconds(summary['queue_wait_p95'])}, "
+          f"p99 {seconds(summary['queue_wait_p99'])}")
+    print(f"  output tokens/s: {rate(summary.get('output_tokens_per_second'))} overall, "
+          f"{rate(summary['output_tokens_per_request_second'])} per request")
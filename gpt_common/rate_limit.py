@@ -0,0 +1,170 @@
+"""
+Client-side rate limiting for the OpenAI API.
+
+RateLimiter is a token-bucket scheduler shared by all threads (and coroutines) of a run.
+It tracks both the requests-per-minute and the tokens-per-minute budget: a request
+reserves one request plus its estimated tokens (input tokens + max_tokens) and waits
+until both buckets can cover it. The budgets can be given up front and are adjusted
+from the x-ratelimit-* response headers; a 429 pauses every caller for a jittered,
+exponentially growing delay. Throughput then stays just under the limits instead of
+alternating between bursts and rate-limit errors.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from typing import Mapping, Optional
+
+BACKOFF_BASE = 1.0  # seconds
+BACKOFF_CAP = 60.0
+
+
+class _Bucket:
+    """Token bucket refilled continuously up to a per-minute capacity (None = unlimited)."""
+
+    def __init__(self, per_minute: Optional[float]):
+        self.capacity = per_minute
+        self.level = per_minute or 0.0
+
+    def set_capacity(self, per_minute: float):
+        if self.capacity is None:
+            self.level = per_minute
+        self.capacity = per_minute
+        self.level = min(self.level, per_minute)
+
+    def refill(self, elapsed: float):
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level + elapsed * self.capacity / 60.0)
+
+    def time_until(self, amount: float) -> float:
+        """Seconds until the bucket holds `amount` (capped at its capacity)."""
+        if self.capacity is None:
+            return 0.0
+        deficit = min(amount, self.capacity) - self.level
+        return max(0.0, deficit * 60.0 / self.capacity)
+
+    def take(self, amount: float):
+        if self.capacity is not None:
+            self.level -= min(amount, self.capacity)
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Jittered exponential backoff for retry number `attempt` (0-based), at least `retry_after`."""
+    delay = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)
+    return max(random.uniform(delay / 2, delay), retry_after or 0.0)
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """Parse durations such as '1s', '6m0s' or '20ms' used by the x-ratelimit-reset-* headers."""
+    total = 0.0
+    number = ''
+    k = 0
+    while k < len(value):
+        c = value[k]
+        if c.isdigit() or c == '.':
+            number += c
+        elif number:
+            if value.startswith('ms', k):
+                total += float(number) / 1000
+                k += 1
+            elif c in 'hms':
+                total += float(number) * {'h': 3600, 'm': 60, 's': 1}[c]
+            else:
+                return None
+            number = ''
+        k += 1
+    return total + float(number) if number else total
+
+
+class RateLimiter:
+    """Shared requests-per-minute / tokens-per-minute scheduler."""
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None):
+        self._lock = threading.Lock()
+        self._buckets = {'requests': _Bucket(rpm), 'tokens': _Bucket(tpm)}
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+
+    def _reserve(self, tokens: int) -> float:
+        """Take one request and `tokens` tokens if both are available, otherwise return the time to wait."""
+        needs = {'requests': 1, 'tokens': tokens}
+        with self._lock:
+            now = time.monotonic()
+            for bucket in self._buckets.values():
+                bucket.refill(now - self._last_refill)
+            self._last_refill = now
+            wait = max([self._paused_until - now] +
+                       [bucket.time_until(needs[name]) for name, bucket in self._buckets.items()])
+            if wait > 0:
+                return wait
+            for name, bucket in self._buckets.items():
+                bucket.take(needs[name])
+            return 0.0
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Block until a request of `tokens` estimated tokens fits the budgets; return the time waited."""
+        waited = 0.0
+        while (wait := self._reserve(tokens)) > 0:
+            time.sleep(wait)
+            waited += wait
+        return waited
+
+    async def acquire_async(self, tokens: int = 0) -> float:
+        """Async version of acquire."""
+        waited = 0.0
+        while (wait := self._reserve(tokens)) > 0:
+            await asyncio.sleep(wait)
+            waited += wait
+        return waited
+
+    def update_from_headers(self, headers: Mapping[str, str]):
+        """Adjust the budgets to the x-ratelimit-* headers of a response, if present."""
+        with self._lock:
+            for name in ('requests', 'tokens'):
+                bucket = self._buckets[name]
+                try:
+                    limit = headers.get(f'x-ratelimit-limit-{name}')
+                    if limit is not None:
+                        bucket.set_capacity(float(limit))
+                    remaining = headers.get(f'x-ratelimit-remaining-{name}')
+                    if remaining is not None and bucket.capacity is not None:
+                        bucket.level = min(bucket.level, float(remaining))
+                except ValueError:
+                    continue
+
+    def pause(self, delay: float):
+        """Hold back every caller for `delay` seconds (after a rate-limit error)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+
+def retry_after_seconds(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Delay requested by a rate-limited response (retry-after-ms, retry-after or reset headers)."""
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        pass
+    resets = [_parse_duration(headers[name]) for name in ('x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens')
+              if headers.get(name)]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+_rate_limiter = None
+
+
+def configure_rate_limiter(rpm: Optional[float] = None, tpm: Optional[float] = None):
+    """Install the process-wide rate limiter (budgets may be None and learned from response headers)."""
+    global _rate_limiter
+    _rate_limiter = RateLimiter(rpm, tpm)
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """Return the process-wide rate limiter, or None if none is configured."""
+    return _rate_limiter
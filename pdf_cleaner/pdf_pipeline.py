@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+PDF to Clean Text Pipeline
+
+Extracts the text of an academic paper PDF and cleans it with GPT in one streaming pass:
+1. Pages are extracted one at a time (optionally by several processes, see pdf_to_txt.py)
+   and pre-cleaned locally: page numbers, running headers/footers, line numbers and
+   hyphenation are removed (see pre_clean.py)
+2. An incremental token chunker turns the pages into chunks as they arrive
+3. Every chunk is sent for cleaning as soon as it is full (unless it has no extraction
+   artifacts left, see pre_clean.looks_clean)
+4. Cleaned chunks are written in order as soon as they are ready
+
+The first cleaned chunk is written while later pages are still being extracted, and no
+intermediate .txt file is needed. The output has the same format as running pdf_to_txt.py
+followed by pdf_text_cleaner.py, and runs are checkpointed to OUTPUT.journal the same way.
+
+Usage:
+    python pdf_pipeline.py paper.pdf cleaned_paper.txt [options]
+
+Options:
+    --model MODEL           GPT model to use (default: gpt-4o-mini)
+    --max-chunk-tokens N    Maximum tokens per chunk (default: 10000)
+    --concurrency N         Number of chunks cleaned in parallel (default: 4)
+    --workers N             Number of processes extracting pages (default: 1)
+    --no-cache              Always call the API instead of reusing cached responses
+    --rpm N, --tpm N        Requests / tokens per minute allowed by the API key (default: from response headers)
+    --metrics-file FILE     Append per-call metrics to FILE as JSON lines (a summary is always printed)
+    --no-pre-clean          Do not pre-clean the pages locally (the token reduction is reported otherwise)
+    --clean-all             Also send the chunks that have no extraction artifacts left (kept as is by default)
+    --edits                 Ask the model only for line edits, applied locally (see pdf_text_cleaner.py)
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import Iterable, Iterator, Optional
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from gpt_common.cache import configure_cache
+from gpt_common.client import configure_client_pool
+from gpt_common.metrics import configure_metrics, print_summary
+from gpt_common.rate_limit import configure_rate_limiter
+from pdf_text_cleaner import (CleaningJournal, count_tokens, iter_clean_chunks, iter_split_text_by_tokens,
+                              report_failed_chunks, report_pre_clean)
+from pdf_to_txt import iterPdfText
+from pre_clean import iter_pre_clean_pages
+
+
+def iter_pdf_pieces(pdf_file: str, workers: int = 1, pre_clean: bool = False, token_counts: Optional[dict] = None,
+                    model: str = "gpt-4o-mini") -> Iterator[str]:
+    """Yield the text of a PDF page by page, with the same page separators as pdf_to_txt.
+
+    With pre_clean, the pages go through iter_pre_clean_pages (the first few pages are held
+    back to learn the running headers/footers). If token_counts is given, the tokens of the
+    pages before and after pre-cleaning are added up in its 'before' and 'after' entries.
+    """
+    def counted(pages: Iterable[str], key: str) -> Iterator[str]:
+        for text in pages:
+            if token_counts is not None:
+                token_counts[key] = token_counts.get(key, 0) + count_tokens(text, model)
+            yield text
+
+    pages = iterPdfText(pdf_file, workers)
+    if pre_clean:
+        pages = counted(iter_pre_clean_pages(counted(pages, 'before')), 'after')
+    for page_num, text in enumerate(pages):
+        yield text if page_num == 0 else "\n" + text
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract and clean academic paper text from a PDF')
+    parser.add_argument('input_file', help='Path to the input PDF file')
+    parser.add_argument('output_file', help='Path to save the cleaned output')
+    parser.add_argument('--model', default='gpt-4o-mini', help='GPT model to use')
+    parser.add_argument('--max-chunk-tokens', type=int, default=10000,
+                      help='Maximum tokens per chunk (default: 10000 for GPT-4o-mini)')
+    parser.add_argument('--concurrency', type=int, default=4,
+                      help='Number of chunks cleaned in parallel (default: 4)')
+    parser.add_argument('--workers', type=int, default=1,
+                      help='Number of processes extracting pages (default: 1)')
+    parser.add_argument('--no-cache', action='store_true',
+                      help='Do not reuse (or store) cached responses of earlier runs')
+    parser.add_argument('--rpm', type=float, default=None,
+                      help='Requests-per-minute limit of the API key (default: learned from response headers)')
+    parser.add_argument('--tpm', type=float, default=None,
+                      help='Tokens-per-minute limit of the API key (default: learned from response headers)')
+    parser.add_argument('--metrics-file', default=None,
+                      help='Append per-call metrics (latency, tokens, retries, cache hits) to this file as JSON lines')
+    parser.add_argument('--no-pre-clean', action='store_true',
+                      help='Send the text as is, without first removing page numbers, running headers/footers, '
+                           'line numbers and hyphenation locally')
+    parser.add_argument('--clean-all', action='store_true',
+                      help='Send every chunk to the API, also those without extraction artifacts')
+    parser.add_argument('--edits', action='store_true',
+                      help='Ask the model for line edits instead of the whole cleaned text (far fewer output tokens '
+                           'for lightly corrupted text); the edits are applied locally')
+    
+    args = parser.parse_args()
+    configure_client_pool(args.concurrency)
+    configure_cache(enabled=not args.no_cache)
+    configure_rate_limiter(args.rpm, args.tpm)
+    configure_metrics(args.metrics_file)
+    
+    start_time = time.perf_counter()
+    first_output_time = None
+    total_tokens_processed = 0
+    
+    # Resume from the checkpoint journal of an interrupted run
+    journal = CleaningJournal(args.output_file + '.journal', args.model)
+    token_counts = {}
+    pieces = iter_pdf_pieces(args.input_file, args.workers, not args.no_pre_clean, token_counts, args.model)
+    chunks = iter_split_text_by_tokens(pieces, args.max_chunk_tokens, args.model)
+    with open(args.output_file, 'w', encoding='utf-8') as f:
+        for i, (cleaned_chunk, chunk_tokens) in enumerate(iter_clean_chunks(chunks, args.model, args.concurrency,
+                                                                            journal=journal,
+                                                                            skip_clean=not args.clean_all,
+                                                                            edits=args.edits)):
+            if i > 0:
+                f.write('\n')
+            f.write(cleaned_chunk)
+            f.flush()
+            total_tokens_processed += chunk_tokens
+            if first_output_time is None:
+                first_output_time = time.perf_counter() - start_time
+    report_failed_chunks(journal)
+    if token_counts:
+        report_pre_clean(args.input_file, token_counts['before'], token_counts.get('after', 0))
+    
+    print(f"Cleaned text saved to {args.output_file}")
+    print(f"Total tokens processed: {total_tokens_processed}")
+    if first_output_time is not None:
+        print(f"Time to first output: {first_output_time:.2f}s")
+    print(f"Total time: {time.perf_counter() - start_time:.2f}s")
+    print_summary()
+
+if __name__ == "__main__":
+    main()
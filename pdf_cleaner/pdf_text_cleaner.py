@@ -11,10 +11,16 @@ issues in PDF-to-text conversion such as:
 - Paragraph structure preservation
 
 The script processes large texts by:
-1. Splitting the text into chunks based on token count
-2. Attempting to split chunks at natural sentence boundaries
-3. Using GPT to clean each chunk
-4. Combining the cleaned chunks into a final output
+1. Removing page numbers, running headers/footers, line numbers and hyphenation locally
+   (pre_clean.py), so that no tokens are spent on them
+2. Splitting the text into chunks based on token count
+3. Attempting to split chunks at natural sentence boundaries
+4. Using GPT to clean each chunk that still has extraction artifacts; a chunk whose cleaned
+   answer is cut off at max_tokens is bisected and its halves are cleaned again
+5. Combining the cleaned chunks into a final output
+
+Progress is checkpointed to OUTPUT.journal after every chunk; rerunning the same command after
+a failure resumes from the chunks that are not done yet.
 
 Usage:
     python clean_academic_text.py input.txt output.txt [options]
@@ -23,9 +29,24 @@ Options:
     --model MODEL           GPT model to use (default: gpt-4o-mini)
     --max-chunk-tokens N    Maximum tokens per chunk (default: 10000)
     --debug-dir DIR        Directory to save debug chunks (if empty, debug output is disabled)
+    --concurrency N         Number of chunks cleaned in parallel (default: 1)
+    --no-cache              Always call the API instead of reusing cached responses
+    --rpm N, --tpm N        Requests / tokens per minute allowed by the API key (default: from response headers)
+    --metrics-file FILE     Append per-call metrics to FILE as JSON lines (a summary is always printed)
+    --stream                Stream the responses into the output file as they arrive (reports tokens/s)
+    --batch                 Submit the chunks as a Batch API job (half price, results within 24h); the input
+                            may then be a directory of .txt files, cleaned into the output directory
+    --poll-interval SEC     Seconds between batch status checks (default: 60)
+    --no-pre-clean          Do not remove page numbers, running headers/footers, line numbers and hyphenation
+                            locally before chunking (the token reduction is reported otherwise)
+    --clean-all             Also send the chunks that have no extraction artifacts left (stray numbers,
+                            ligatures, broken hyphenation, garbage characters); by default they are kept as is
+    --edits                 Ask the model only for the lines to delete or replace (by line ID) and apply them
+                            locally, instead of having it echo the whole cleaned chunk
 
 Requirements:
-    - OpenAI API access (set OPENAI_API_KEY environment variable)
+    - OpenAI API access (set OPENAI_API_KEY environment variable; set OPENAI_BASE_URL to
+      run against a local mock chat-completions server instead)
     - Python packages: openai, tiktoken
 
 Example:
@@ -33,59 +54,141 @@ Example:
 """
 
 import os
-from openai import OpenAI
+import sys
+import hashlib
+import json
+import queue
+import threading
+import time
 import tiktoken
-from typing import List, Tuple
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 import argparse
+import bisect
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import accumulate
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from gpt_common.batch import POLL_INTERVAL, run_batch
+from gpt_common.cache import configure_cache
+from gpt_common.chat import chat_completion
+from gpt_common.client import configure_client_pool
+from gpt_common.metrics import configure_metrics, print_summary, record_call
+from gpt_common.rate_limit import configure_rate_limiter
+from pre_clean import looks_clean, pre_clean_text
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = "gpt-4o-mini") -> tiktoken.Encoding:
+    """Return the tiktoken encoder for a model, loading it only once per process."""
+    return tiktoken.encoding_for_model(model)
+
+@lru_cache(maxsize=None)
+def token_byte_lengths(model: str = "gpt-4o-mini") -> List[int]:
+    """Return the UTF-8 byte length of every token in the model's vocabulary."""
+    encoding = get_encoding(model)
+    lengths = []
+    for token in range(encoding.n_vocab):
+        try:
+            lengths.append(len(encoding.decode_single_token_bytes(token)))
+        except KeyError:  # unused token id
+            lengths.append(0)
+    return lengths
 
 def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
     """Count the number of tokens in a text string."""
-    encoding = tiktoken.encoding_for_model(model)
+    encoding = get_encoding(model)
     return len(encoding.encode(text))
 
 def split_text_by_tokens(text: str, max_tokens: int = 10000, model: str = "gpt-4o-mini") -> List[str]:
-    """Split text into chunks based on token count, trying to split at natural sentence breaks."""
-    encoding = tiktoken.encoding_for_model(model)
+    """Split text into chunks based on token count, trying to split at natural sentence breaks.
+
+    The text is encoded once; the byte offsets of the tokens (from a per-model table of token
+    lengths) map each token window back to the text, so the chunks partition the input exactly
+    (''.join(chunks) == text).
+    """
+    encoding = get_encoding(model)
     tokens = encoding.encode(text)
+    data = text.encode('utf-8')
+    # offsets[k] is the byte position where token k starts; offsets[len(tokens)] == len(data)
+    offsets = [0, *accumulate(map(token_byte_lengths(model).__getitem__, tokens))]
     chunks = []
-    sentence_breaks = [".", "!", "?", ";", ":"]
-    current_pos = 0
+    sentence_breaks = [b".", b"!", b"?", b";", b":"]
+    start = 0
 
-    while current_pos < len(tokens):
-        # Get the next chunk of tokens
-        chunk_tokens = tokens[current_pos:current_pos + max_tokens]
-        chunk_text = encoding.decode(chunk_tokens)
+    while start < len(data):
+        # Token containing the first byte of this chunk
+        current_pos = bisect.bisect_right(offsets, start) - 1
         
-        # If this is the last chunk or no sentence breaks found, use the entire chunk
+        # If this is the last chunk, use the rest of the text
         if current_pos + max_tokens >= len(tokens):
-            chunks.append(chunk_text)
+            chunks.append(data[start:].decode('utf-8'))
             break
+        end = offsets[current_pos + max_tokens]
         
         # Try to find the last sentence break
         last_break_pos = -1
         for break_token in sentence_breaks:
-            pos = chunk_text.rfind(break_token)
+            pos = data.rfind(break_token, start, end)
             if pos > last_break_pos:
                 last_break_pos = pos
         
         if last_break_pos != -1:
             # Split at the sentence break
-            chunk_text = chunk_text[:last_break_pos + 1]
-            # Calculate how many tokens we actually used
-            used_tokens = len(encoding.encode(chunk_text))
-            current_pos += used_tokens
+            end = last_break_pos + 1
         else:
-            # If no sentence break found, use the whole chunk
-            current_pos += len(chunk_tokens)
+            # If no sentence break found, use the whole token window, cut at a character boundary
+            while end > start and data[end] & 0xC0 == 0x80:
+                end -= 1
+            if end == start:
+                end += 1
+                while end < len(data) and data[end] & 0xC0 == 0x80:
+                    end += 1
         
-        chunks.append(chunk_text)
+        chunks.append(data[start:end].decode('utf-8'))
+        start = end
     
     return chunks
 
-def read_file_in_chunks(file_path: str, max_tokens: int = 10000, model: str = "gpt-4o-mini") -> List[str]:
-    """Read file and split into chunks based on token count."""
+def iter_split_text_by_tokens(pieces: Iterable[str], max_tokens: int = 10000,
+                              model: str = "gpt-4o-mini") -> Iterator[str]:
+    """Incremental version of split_text_by_tokens for text that arrives in pieces (e.g. PDF pages).
+
+    Each chunk is yielded as soon as enough text has arrived to fill it; only the unfinished
+    chunk is kept in memory.
+    """
+    buffer = ''
+    buffer_tokens = 0
+    for piece in pieces:
+        buffer += piece
+        buffer_tokens += count_tokens(piece, model)
+        if buffer_tokens > max_tokens:
+            chunks = split_text_by_tokens(buffer, max_tokens, model)
+            yield from chunks[:-1]
+            buffer = chunks[-1]
+            buffer_tokens = count_tokens(buffer, model)
+    if buffer:
+        yield buffer
+
+def report_pre_clean(name: str, tokens_before: int, tokens_after: int):
+    """Print the tokens the pre-cleaner removed from a document."""
+    removed = tokens_before - tokens_after
+    print(f"Pre-cleaned {name}: {tokens_before} -> {tokens_after} tokens "
+          f"({removed} removed, {100 * removed / max(tokens_before, 1):.1f}%)")
+
+def read_file_in_chunks(file_path: str, max_tokens: int = 10000, model: str = "gpt-4o-mini",
+                        pre_clean: bool = False, report: bool = True) -> List[str]:
+    """Read file and split into chunks based on token count.
+
+    With pre_clean, page numbers, running headers/footers, line numbers and hyphenation are
+    removed first (see pre_clean.py), and the token reduction is reported unless report is False.
+    """
     with open(file_path, 'r', encoding='utf-8') as file:
         text = file.read()
+    if pre_clean:
+        cleaned = pre_clean_text(text)
+        if report:
+            report_pre_clean(file_path, count_tokens(text, model), count_tokens(cleaned, model))
+        text = cleaned
     return split_text_by_tokens(text, max_tokens, model)
 
 def save_chunk_to_file(chunk: str, chunk_num: int, prefix: str, output_dir: str):
@@ -95,36 +198,482 @@ def save_chunk_to_file(chunk: str, chunk_num: int, prefix: str, output_dir: str)
     with open(filename, 'w', encoding='utf-8') as f:
         f.write(chunk)
 
-def clean_text_with_gpt(text: str, model: str = "gpt-4o-mini") -> Tuple[str, int]:
-    """Use GPT to clean academic text."""
-    client = OpenAI()
-    
-    system_prompt = """You are a text cleaning assistant. Your task is to:
+CLEANING_SYSTEM_PROMPT = """You are a text cleaning assistant. Your task is to:
     1. Remove line numbers, page numbers, and headers/footers
     2. Remove special characters that are artifacts of PDF conversion
     3. Preserve the actual content including equations (convert corrupted equation symbols to proper ones if possible)
     4. Maintain the captions of figures and tables
     5. Maintain paragraph structure and section titles
     Return only the cleaned text without any explanations."""
+
+# Edit mode: instead of echoing the whole cleaned text, the model lists the lines to change
+EDITS_SYSTEM_PROMPT = """You are a text cleaning assistant for text extracted from academic paper PDFs. Every line of the
+    input starts with its line ID and '|'. Find what needs cleaning:
+    1. Line numbers, page numbers, and headers/footers
+    2. Special characters that are artifacts of PDF conversion, and words broken across lines
+    3. Corrupted equation symbols (convert them to proper ones if possible)
+    Keep the actual content, the captions of figures and tables, the paragraph structure and section titles.
+    Do not return the text. Return a JSON object {"edits": [...]} listing only the lines that change, in order,
+    without overlaps. Each edit is {"from": first line ID, "to": last line ID, "text": replacement}: lines
+    from..to (inclusive) are replaced by text (without line IDs, may contain newlines); use "" to delete them.
+    Lines without an edit are kept as they are. Return {"edits": []} if nothing needs cleaning."""
+
+MIN_SPLIT_TOKENS = 200  # pieces this short are not bisected any further when their answer is truncated
+
+def cleaning_request(text: str, model: str = "gpt-4o-mini") -> dict:
+    """Arguments of the chat-completion request that cleans a chunk of text."""
+    return dict(
+        model=model,
+        messages=[
+            {"role": "developer", "content": CLEANING_SYSTEM_PROMPT},
+            {"role": "user", "content": f"Clean this academic text:\n\n{text}"}
+        ],
+        temperature=0.0,  # Keep it deterministic
+        max_tokens=16000  # GPT-4o-mini max output tokens
+    )
+
+def number_lines(text: str) -> str:
+    """Prefix every line with its 1-based line ID, as referenced by the edits."""
+    return '\n'.join(f"{i}|{line}" for i, line in enumerate(text.split('\n'), 1))
+
+def edits_request(text: str, model: str = "gpt-4o-mini") -> dict:
+    """Arguments of the chat-completion request that asks for the edits cleaning a chunk of text."""
+    return dict(
+        model=model,
+        messages=[
+            {"role": "developer", "content": EDITS_SYSTEM_PROMPT},
+            {"role": "user", "content": f"List the edits cleaning this academic text:\n\n{number_lines(text)}"}
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.0,
+        max_tokens=16000
+    )
+
+def _edit_text(text: Optional[str]) -> str:
+    """The replacement text of an edit: null deletes the lines, anything but a string is malformed."""
+    if text is None:
+        return ''
+    if not isinstance(text, str):
+        raise TypeError(f"edit text is a {type(text).__name__}, not a string")
+    return text
+
+def apply_edits(text: str, content: str) -> str:
+    """Apply the edits of a JSON answer to the lines of text; raises ValueError if they cannot be applied."""
+    lines = text.split('\n')
+    try:
+        edits = json.loads(content)['edits']
+        edits = sorted(((int(e['from']), int(e['to']), _edit_text(e['text'])) for e in edits), key=lambda e: e[0])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Malformed edits: {e}") from e
+    cleaned = []
+    next_line = 1
+    for first, last, replacement in edits:
+        if not next_line <= first <= last <= len(lines):
+            raise ValueError(f"Edit of lines {first}-{last} is out of order or out of range")
+        cleaned.extend(lines[next_line - 1:first - 1])
+        if replacement:
+            cleaned.append(replacement)
+        next_line = last + 1
+    cleaned.extend(lines[next_line - 1:])
+    return '\n'.join(cleaned)
+
+def cleaned_from_edits(text: str, content: str, model: str = "gpt-4o-mini") -> str:
+    """Apply an edits answer to text; if that fails, clean the text in full instead."""
+    try:
+        return apply_edits(text, content).strip()
+    except ValueError as e:
+        print(f"{e}; cleaning the text in full instead")
+        return clean_text_with_gpt(text, model, fallback=False)[0]
+
+def split_in_half(text: str, model: str = "gpt-4o-mini") -> Tuple[str, str]:
+    """Split text in two at the last sentence break before the middle (by tokens); first + second == text."""
+    first = split_text_by_tokens(text, (count_tokens(text, model) + 1) // 2, model)[0]
+    if not first.rstrip().endswith(('.', '!', '?', ';', ':')):
+        # No sentence break before the middle: split at the last line break (or space) rather than inside a word
+        space = first.rfind('\n') if '\n' in first else first.rfind(' ')
+        if space > 0:
+            first = first[:space + 1]
+    return first, text[len(first):]
+
+def clean_text_in_halves(text: str, model: str = "gpt-4o-mini", edits: bool = False) -> str:
+    """Clean text whose cleaned answer did not fit in max_tokens: bisect it and clean both halves.
+
+    Halves that are still too long are bisected again. The halves are cleaned one after the
+    other by the caller's thread, so the requests in flight stay within --concurrency (and the
+    connection pool sized to it). Raises RuntimeError if the text is too short to be split any further.
+    """
+    if count_tokens(text, model) < MIN_SPLIT_TOKENS:
+        raise RuntimeError(f"Cleaned answer truncated even for a {count_tokens(text, model)}-token piece")
+    first, second = split_in_half(text, model)
+    boundary = first[len(first.rstrip()):] + second[:len(second) - len(second.lstrip())]
+    separator = '\n' if '\n' in boundary else ' '
+    print(f"Answer truncated, cleaning the text again in two halves "
+          f"({count_tokens(first, model)} + {count_tokens(second, model)} tokens)")
+    cleaned_first, _ = clean_text_with_gpt(first, model, fallback=False, edits=edits)
+    cleaned_second, _ = clean_text_with_gpt(second, model, fallback=False, edits=edits)
+    return cleaned_first + separator + cleaned_second
+
+def clean_text_with_gpt(text: str, model: str = "gpt-4o-mini", fallback: bool = True,
+                        on_delta: Optional[Callable[[str], None]] = None,
+                        queued_at: Optional[float] = None,
+                        on_restart: Optional[Callable[[], None]] = None, edits: bool = False) -> Tuple[str, int]:
+    """Use GPT to clean academic text.
+
+    If the API call fails, the original text is returned when `fallback` is set; otherwise the error is raised.
+    If `on_delta` is given, the response is streamed and every piece of it is passed to on_delta as it arrives.
+    `queued_at` (a time.perf_counter() value) is when the chunk was queued, for the queue-wait metric.
+    If the answer is cut off at max_tokens, the text is cleaned again in halves (clean_text_in_halves):
+    on_restart() is called to void everything passed to on_delta so far, and the joined halves
+    are passed to on_delta in one piece.
+
+    With `edits`, the model only lists the line edits (edits_request), which are applied here,
+    so the answer is a fraction of the text; nothing is streamed then, and the cleaned text is
+    passed to on_delta in one piece. If the edits cannot be applied, the text is cleaned in full.
+    """
+    request = edits_request(text, model) if edits else cleaning_request(text, model)
     
     # Count tokens in the prompt and text
     text_tokens = count_tokens(text, model)
     
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "developer", "content": system_prompt},
-                {"role": "user", "content": f"Clean this academic text:\n\n{text}"}
-            ],
-            temperature=0.0,  # Keep it deterministic
-            max_tokens=16000  # GPT-4o-mini max output tokens
+        result = chat_completion(
+            **request,
+            on_delta=None if edits else on_delta,
+            label='clean-edits' if edits else 'clean',
+            queued_at=queued_at,
+            # Budget charged to the rate limiter: prompt, text and the largest possible answer
+            request_tokens=sum(count_tokens(m['content'], model) for m in request['messages']) + request['max_tokens']
         )
-        return response.choices[0].message.content.strip(), text_tokens
+        if result.finish_reason == 'length':
+            if on_restart is not None:
+                on_restart()
+            cleaned_text = clean_text_in_halves(text, model, edits)
+        elif edits:
+            cleaned_text = cleaned_from_edits(text, result.content, model)
+        else:
+            return result.content.strip(), text_tokens
+        if on_delta is not None:
+            on_delta(cleaned_text)
+        return cleaned_text, text_tokens
     except Exception as e:
+        if not fallback:
+            raise
         print(f"Error in API call: {e}")
         return text, text_tokens  # Return original text if API call fails
 
+class CleaningJournal:
+    """Checkpoint journal of cleaned chunks, kept next to the output file.
+
+    Every cleaned chunk is appended (as a JSON line with the chunk's hash) as soon as it is done,
+    so a rerun after a failure or a kill only cleans the chunks that are not in the journal yet.
+    """
+    
+    def __init__(self, path: str, model: str = "gpt-4o-mini"):
+        self.path = path
+        self.model = model
+        self.entries = {}
+        self.failed_chunks = 0
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # line cut short by a kill
+                    self.entries[entry['hash']] = entry
+        self._file = open(path, 'a', encoding='utf-8')
+    
+    def chunk_hash(self, chunk: str) -> str:
+        """Hash of everything that determines the cleaned chunk."""
+        return hashlib.sha256('\0'.join([self.model, CLEANING_SYSTEM_PROMPT, chunk]).encode('utf-8')).hexdigest()
+    
+    def get(self, chunk: str) -> Optional[Tuple[str, int]]:
+        """Return (cleaned chunk, tokens) if the chunk was cleaned by an earlier run."""
+        entry = self.entries.get(self.chunk_hash(chunk))
+        return (entry['cleaned'], entry['tokens']) if entry else None
+    
+    def record(self, chunk: str, cleaned_chunk: str, chunk_tokens: int):
+        """Append a cleaned chunk to the journal and flush it to disk."""
+        entry = {'hash': self.chunk_hash(chunk), 'cleaned': cleaned_chunk, 'tokens': chunk_tokens}
+        with self._lock:
+            self.entries[entry['hash']] = entry
+            self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+    
+    def record_failure(self):
+        """Count a chunk that could not be cleaned (it is not journaled, so a rerun retries it)."""
+        with self._lock:
+            self.failed_chunks += 1
+    
+    def close(self, remove: bool = False):
+        """Close the journal; remove it once the output has been written completely."""
+        self._file.close()
+        if remove:
+            os.remove(self.path)
+
+class OrderedStreamWriter:
+    """Writes chunks to one file in their original order while they are still streaming in.
+
+    The first unfinished chunk streams straight into the file; later chunks (cleaned concurrently)
+    are buffered until all chunks before them are done. Chunks are separated by newlines and
+    streamed text is stripped, so the file ends up as '\n'.join of the stripped chunks.
+    """
+    
+    def __init__(self, file):
+        self.file = file
+        self.next_chunk = 1
+        self.head_start = file.tell()  # file position where the first unfinished chunk starts
+        self.buffers = {}
+        self.pending_space = {}
+        self.started = set()
+        self.finished = set()
+        self._lock = threading.Lock()
+    
+    def _emit(self, i: int, text: str):
+        if i not in self.started:
+            self.started.add(i)
+            if i > 1:
+                text = '\n' + text
+        if i == self.next_chunk:
+            self.file.write(text)
+            self.file.flush()
+        else:
+            self.buffers.setdefault(i, []).append(text)
+    
+    def stream(self, i: int, delta: str):
+        """Add a piece of chunk i's streamed response; leading and trailing whitespace of the chunk is dropped."""
+        with self._lock:
+            if i not in self.pending_space:
+                delta = delta.lstrip()
+                if not delta:
+                    return
+                self.pending_space[i] = ''
+            text = self.pending_space[i] + delta
+            stripped = text.rstrip()
+            # Trailing whitespace is held back until more text follows it
+            self.pending_space[i] = text[len(stripped):]
+            self._emit(i, stripped)
+    
+    def write(self, i: int, text: str):
+        """Add text to chunk i as it is."""
+        with self._lock:
+            self._emit(i, text)
+    
+    def discard(self, i: int):
+        """Drop everything chunk i has written so far (e.g. a response that failed halfway)."""
+        with self._lock:
+            self.pending_space.pop(i, None)
+            self.buffers.pop(i, None)
+            self.started.discard(i)
+            if i == self.next_chunk:
+                self.file.seek(self.head_start)
+                self.file.truncate()
+    
+    def finish(self, i: int):
+        """Mark chunk i as complete; the next chunks take over the file as soon as they are at its head."""
+        with self._lock:
+            self._emit(i, '')  # an empty chunk still gets its separator
+            self.started.discard(i)
+            self.pending_space.pop(i, None)
+            self.finished.add(i)
+            while self.next_chunk in self.finished:
+                self.finished.remove(self.next_chunk)
+                self.next_chunk += 1
+                self.head_start = self.file.tell()
+                self.file.write(''.join(self.buffers.pop(self.next_chunk, [])))
+                self.file.flush()
+
+def iter_clean_chunks(chunks: Iterable[str], model: str = "gpt-4o-mini", concurrency: int = 1,
+                      debug_dir: str = '', num_chunks: Optional[int] = None,
+                      journal: Optional[CleaningJournal] = None,
+                      stream_writer: Optional[OrderedStreamWriter] = None,
+                      skip_clean: bool = False, edits: bool = False) -> Iterator[Tuple[str, int]]:
+    """Clean chunks with up to `concurrency` requests in flight, yielding (cleaned chunk, tokens) in original order.
+
+    `chunks` may be a lazy iterator: each chunk is submitted as soon as it is produced, and each
+    result is yielded as soon as it and all chunks before it are done. Chunks found in the
+    journal are not sent again; newly cleaned chunks are recorded in it. With a stream_writer,
+    responses are streamed and written to it while they arrive. With skip_clean, chunks that
+    look clean already (see pre_clean.looks_clean) are kept as they are instead of being sent.
+    With edits, the model is asked for line edits instead of the cleaned text (see clean_text_with_gpt).
+    """
+    def process_chunk(i: int, chunk: str, queued_at: Optional[float] = None) -> Tuple[str, int]:
+        print(f"Processing chunk {i}/{num_chunks}..." if num_chunks else f"Processing chunk {i}...")
+        
+        # Save original chunk
+        if debug_dir:
+            save_chunk_to_file(chunk, i, "original", debug_dir)
+        
+        # Clean the chunk (or restore it from the checkpoint journal)
+        restored = journal.get(chunk) if journal else None
+        if restored:
+            cleaned_chunk, chunk_tokens = restored
+            print(f"Restored chunk {i} from checkpoint")
+            if stream_writer:
+                stream_writer.write(i, cleaned_chunk)
+        elif skip_clean and looks_clean(chunk):
+            cleaned_chunk, chunk_tokens = chunk.strip(), count_tokens(chunk, model)
+            record_call(label='clean', model=model, skipped=True)
+            print(f"Chunk {i} looks clean already, not sent")
+            if stream_writer:
+                stream_writer.write(i, cleaned_chunk)
+        else:
+            try:
+                on_delta = (lambda delta: stream_writer.stream(i, delta)) if stream_writer else None
+                on_restart = (lambda: stream_writer.discard(i)) if stream_writer else None
+                cleaned_chunk, chunk_tokens = clean_text_with_gpt(chunk, model, fallback=False, on_delta=on_delta,
+                                                                  queued_at=queued_at, on_restart=on_restart,
+                                                                  edits=edits)
+                if journal:
+                    journal.record(chunk, cleaned_chunk, chunk_tokens)
+            except Exception as e:
+                print(f"Error in API call: {e}")
+                # Keep the original text, but not in the journal, so a rerun retries the chunk
+                cleaned_chunk, chunk_tokens = chunk, count_tokens(chunk, model)
+                if journal:
+                    journal.record_failure()
+                if stream_writer:
+                    stream_writer.discard(i)
+                    stream_writer.write(i, chunk)
+        if stream_writer:
+            stream_writer.finish(i)
+        
+        # Save cleaned chunk
+        if debug_dir:
+            save_chunk_to_file(cleaned_chunk, i, "cleaned", debug_dir)
+        
+        print(f"Processed {chunk_tokens} tokens in chunk {i}")
+        return cleaned_chunk, chunk_tokens
+    
+    if concurrency <= 1:
+        for i, chunk in enumerate(chunks, 1):
+            yield process_chunk(i, chunk)
+        return
+    
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # A producer thread pulls chunks and submits them, so a slow chunk source never delays
+        # yielding finished results; the bounded queue keeps results in submission order
+        futures = queue.Queue(maxsize=2 * concurrency)
+        
+        def produce():
+            try:
+                for i, chunk in enumerate(chunks, 1):
+                    futures.put(executor.submit(process_chunk, i, chunk, time.perf_counter()))
+                futures.put(None)
+            except Exception as e:
+                futures.put(e)
+        
+        threading.Thread(target=produce, daemon=True).start()
+        while True:
+            future = futures.get()
+            if future is None:
+                break
+            if isinstance(future, Exception):
+                raise future
+            yield future.result()
+
+def clean_chunks(chunks: List[str], model: str = "gpt-4o-mini", concurrency: int = 1,
+                 debug_dir: str = '', journal: Optional[CleaningJournal] = None,
+                 skip_clean: bool = False, edits: bool = False) -> Tuple[List[str], int]:
+    """Clean chunks with up to `concurrency` requests in flight, returning results in original order."""
+    results = list(iter_clean_chunks(chunks, model, concurrency, debug_dir, num_chunks=len(chunks), journal=journal,
+                                     skip_clean=skip_clean, edits=edits))
+    cleaned_chunks = [cleaned for cleaned, _ in results]
+    total_tokens_processed = sum(tokens for _, tokens in results)
+    return cleaned_chunks, total_tokens_processed
+
+def report_failed_chunks(journal: CleaningJournal):
+    """Close the journal at the end of a run; keep it (and warn) if some chunks could not be cleaned."""
+    if journal.failed_chunks:
+        print(f"Warning: {journal.failed_chunks} chunks could not be cleaned and were kept as extracted; "
+              f"rerun the same command to retry only those chunks")
+    journal.close(remove=not journal.failed_chunks)
+
+def find_text_files(input_dir: str, output_dir: str) -> List[Tuple[str, str]]:
+    """Return (input, output) paths of the .txt files under input_dir whose cleaned output is missing or older."""
+    files = []
+    for root, _, names in os.walk(input_dir):
+        for name in sorted(names):
+            if not name.endswith('.txt'):
+                continue
+            input_file = os.path.join(root, name)
+            output_file = os.path.join(output_dir, os.path.relpath(input_file, input_dir))
+            if os.path.exists(output_file) and os.path.getmtime(output_file) >= os.path.getmtime(input_file):
+                continue
+            files.append((input_file, output_file))
+    return files
+
+def clean_files_batch(files: List[Tuple[str, str]], model: str = "gpt-4o-mini", max_chunk_tokens: int = 10000,
+                      batch_path: str = 'batch.jsonl', poll_interval: float = POLL_INTERVAL,
+                      pre_clean: bool = True, skip_clean: bool = True, edits: bool = False) -> int:
+    """Clean text files through the Batch API, returning the number of tokens processed.
+
+    The chunks of all (input, output) files go into one batch job (split into several if it
+    exceeds the job limits) and the results are mapped back by chunk id. Every output keeps its
+    own checkpoint journal, so chunks finished by an earlier run are not submitted again. With
+    skip_clean, chunks that look clean already are kept as they are instead of being submitted.
+    Chunks whose answer was cut off at max_tokens are cleaned again right away, in halves.
+    With edits, the model is asked for line edits (see clean_text_with_gpt).
+    """
+    # Collect the chunks that still need cleaning
+    requests = {}
+    for file_num, (input_file, output_file) in enumerate(files):
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        journal = CleaningJournal(output_file + '.journal', model)
+        for chunk_num, chunk in enumerate(read_file_in_chunks(input_file, max_chunk_tokens, model, pre_clean)):
+            if skip_clean and looks_clean(chunk):
+                record_call(label='clean', model=model, skipped=True)
+            elif not journal.get(chunk):
+                requests[f"{file_num}-{chunk_num}"] = (edits_request if edits else cleaning_request)(chunk, model)
+        journal.close()
+    label = 'clean-edits' if edits else 'clean'
+    results = run_batch(requests, batch_path, poll_interval=poll_interval, label=label) if requests else {}
+    
+    # Map the results back to the chunks of every file
+    total_tokens_processed = 0
+    for file_num, (input_file, output_file) in enumerate(files):
+        journal = CleaningJournal(output_file + '.journal', model)
+        cleaned_chunks = []
+        for chunk_num, chunk in enumerate(read_file_in_chunks(input_file, max_chunk_tokens, model, pre_clean,
+                                                              report=False)):
+            restored = journal.get(chunk)
+            result = results.get(f"{file_num}-{chunk_num}")
+            if result and (result.finish_reason not in ('stop', 'length')
+                           or result.finish_reason == 'stop' and not (result.content or '').strip()):
+                # Filtered, or no answer at all: the chunk failed
+                print(f"Error: chunk {chunk_num} of {input_file} finished with '{result.finish_reason}' "
+                      f"and {'an empty' if not (result.content or '').strip() else 'a partial'} answer")
+                result = None
+            if result and (result.finish_reason == 'length' or edits):
+                # Cut off at max_tokens: clean this chunk again, in halves, without waiting for another batch
+                try:
+                    content = (clean_text_in_halves(chunk, model, edits) if result.finish_reason == 'length'
+                               else cleaned_from_edits(chunk, result.content, model))
+                    result = result._replace(content=content, finish_reason='stop')
+                except Exception as e:
+                    print(f"Error in API call: {e}")
+                    result = None
+            if restored:
+                cleaned_chunk, chunk_tokens = restored
+            elif skip_clean and looks_clean(chunk):
+                cleaned_chunk, chunk_tokens = chunk.strip(), count_tokens(chunk, model)
+            elif result and result.content and result.content.strip():
+                cleaned_chunk, chunk_tokens = result.content.strip(), count_tokens(chunk, model)
+                journal.record(chunk, cleaned_chunk, chunk_tokens)
+            else:
+                # Keep the original text, but not in the journal, so a rerun retries the chunk
+                cleaned_chunk, chunk_tokens = chunk, count_tokens(chunk, model)
+                journal.record_failure()
+            cleaned_chunks.append(cleaned_chunk)
+            total_tokens_processed += chunk_tokens
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(cleaned_chunks))
+        report_failed_chunks(journal)
+        print(f"Cleaned text saved to {output_file}")
+    return total_tokens_processed
+
 def main():
     parser = argparse.ArgumentParser(description='Clean academic paper text using GPT')
     parser.add_argument('input_file', help='Path to the input text file')
@@ -134,8 +683,53 @@ def main():
                       help='Maximum tokens per chunk (default: 10000 for GPT-4o-mini)')
     parser.add_argument('--debug-dir', default='',
                       help='Directory to save debug chunks (default: debug_chunks)')
+    parser.add_argument('--concurrency', type=int, default=1,
+                      help='Number of chunks cleaned in parallel (default: 1)')
+    parser.add_argument('--no-cache', action='store_true',
+                      help='Do not reuse (or store) cached responses of earlier runs')
+    parser.add_argument('--rpm', type=float, default=None,
+                      help='Requests-per-minute limit of the API key (default: learned from response headers)')
+    parser.add_argument('--tpm', type=float, default=None,
+                      help='Tokens-per-minute limit of the API key (default: learned from response headers)')
+    parser.add_argument('--stream', action='store_true',
+                      help='Stream responses and write them to the output file (via OUTPUT.part) as they arrive')
+    parser.add_argument('--metrics-file', default=None,
+                      help='Append per-call metrics (latency, tokens, retries, cache hits) to this file as JSON lines')
+    parser.add_argument('--batch', action='store_true',
+                      help='Submit all chunks as a Batch API job and wait for it (lower cost, higher latency); '
+                           'input_file may then be a directory of .txt files and output_file an output directory')
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL,
+                      help=f'Seconds between batch status checks (default: {POLL_INTERVAL:g})')
+    parser.add_argument('--no-pre-clean', action='store_true',
+                      help='Send the text as is, without first removing page numbers, running headers/footers, '
+                           'line numbers and hyphenation locally')
+    parser.add_argument('--clean-all', action='store_true',
+                      help='Send every chunk to the API, also those without extraction artifacts')
+    parser.add_argument('--edits', action='store_true',
+                      help='Ask the model for line edits instead of the whole cleaned text (far fewer output tokens '
+                           'for lightly corrupted text); the edits are applied locally')
     
     args = parser.parse_args()
+    configure_client_pool(args.concurrency)
+    configure_cache(enabled=not args.no_cache)
+    configure_rate_limiter(args.rpm, args.tpm)
+    configure_metrics(args.metrics_file)
+    
+    if args.batch:
+        if os.path.isdir(args.input_file):
+            files = find_text_files(args.input_file, args.output_file)
+            batch_path = os.path.join(args.output_file, 'batch.jsonl')
+            os.makedirs(args.output_file, exist_ok=True)
+            print(f"{len(files)} text files to clean")
+        else:
+            files = [(args.input_file, args.output_file)]
+            batch_path = args.output_file + '.batch.jsonl'
+        total_tokens_processed = clean_files_batch(files, args.model, args.max_chunk_tokens, batch_path,
+                                                   args.poll_interval, not args.no_pre_clean, not args.clean_all,
+                                                   args.edits)
+        print(f"Total tokens processed: {total_tokens_processed}")
+        print_summary()
+        return
     
     # Create debug directory
     if args.debug_dir:
@@ -145,36 +739,34 @@ def main():
         debug_dir = ''
     
     # Read file in chunks based on token count
-    chunks = read_file_in_chunks(args.input_file, args.max_chunk_tokens, args.model)
-    
-    # Process each chunk
-    cleaned_chunks = []
-    total_tokens_processed = 0
+    chunks = read_file_in_chunks(args.input_file, args.max_chunk_tokens, args.model, not args.no_pre_clean)
     
-    for i, chunk in enumerate(chunks, 1):
-        print(f"Processing chunk {i}/{len(chunks)}...")
-        
-        # Save original chunk
-        if debug_dir:
-            save_chunk_to_file(chunk, i, "original", debug_dir)
-        
-        # Clean the chunk
-        cleaned_chunk, chunk_tokens = clean_text_with_gpt(chunk, args.model)
-        
-        # Save cleaned chunk
-        if debug_dir:
-            save_chunk_to_file(cleaned_chunk, i, "cleaned", debug_dir)
+    # Process each chunk, resuming from the checkpoint journal of an interrupted run
+    journal = CleaningJournal(args.output_file + '.journal', args.model)
+    if journal.entries:
+        print(f"Resuming: {len(journal.entries)} chunks found in {journal.path}")
+    if args.stream:
+        # Responses go to a temporary file while they stream in; it replaces the output when complete
+        total_tokens_processed = 0
+        with open(args.output_file + '.part', 'w+', encoding='utf-8') as f:
+            writer = OrderedStreamWriter(f)
+            for _, chunk_tokens in iter_clean_chunks(chunks, args.model, args.concurrency, debug_dir,
+                                                     num_chunks=len(chunks), journal=journal, stream_writer=writer,
+                                                     skip_clean=not args.clean_all, edits=args.edits):
+                total_tokens_processed += chunk_tokens
+        os.replace(args.output_file + '.part', args.output_file)
+    else:
+        cleaned_chunks, total_tokens_processed = clean_chunks(chunks, args.model, args.concurrency, debug_dir, journal,
+                                                            skip_clean=not args.clean_all, edits=args.edits)
         
-        cleaned_chunks.append(cleaned_chunk)
-        total_tokens_processed += chunk_tokens
-        print(f"Processed {chunk_tokens} tokens in chunk {i}")
-    
-    # Write cleaned text to output file
-    with open(args.output_file, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(cleaned_chunks))
+        # Write cleaned text to output file
+        with open(args.output_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(cleaned_chunks))
+    report_failed_chunks(journal)
     
     print(f"Cleaned text saved to {args.output_file}")
     print(f"Total tokens processed: {total_tokens_processed}")
+    print_summary()
     if debug_dir:
         print(f"Debug chunks saved in {debug_dir}")
         print(f"  - Original chunks: original_chunk_*.txt")
@@ -1,5 +1,8 @@
 import PyPDF2
 import argparse
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
 def showPdfText(filename):
@@ -24,14 +27,109 @@ def showPdfText(filename):
             print(text)
             print("-" * 50)
 
-def extractPdfText(filename, outfile):
-    full_text = ""
+def countPdfPages(filename):
+    with open(filename, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+# PDF reader of a worker process, opened once by initPageWorker
+_worker_reader = None
+
+def initPageWorker(filename):
+    global _worker_reader
+    _worker_reader = PyPDF2.PdfReader(open(filename, 'rb'))
+
+def extractPageRange(start, stop):
+    # Extract the text of pages [start, stop) in a worker process
+    page_texts = []
+    for page_num in range(start, stop):
+        page_texts.append(_worker_reader.pages[page_num].extract_text())
+        _worker_reader.resolved_objects.clear()
+    return page_texts
+
+def iterPdfText(filename, workers=1):
+    # Yield the text of one page at a time, so callers never hold the whole document
+    if workers > 1:
+        # Split the pages into more ranges than workers, so that uneven pages balance out;
+        # executor.map returns the ranges in page order
+        num_pages = countPdfPages(filename)
+        range_size = max(1, -(-num_pages // (workers * 4)))
+        starts = list(range(0, num_pages, range_size))
+        stops = [min(start + range_size, num_pages) for start in starts]
+        with ProcessPoolExecutor(max_workers=workers, initializer=initPageWorker, initargs=(filename,)) as executor:
+            for page_texts in executor.map(extractPageRange, starts, stops):
+                yield from page_texts
+        return
+
     with open(filename, 'rb') as file:
         reader = PyPDF2.PdfReader(file)
-        page_texts = [page.extract_text() for page in reader.pages]
-        full_text = "\n".join(page_texts)
+        for page in reader.pages:
+            text = page.extract_text()
+            # Drop the reader's cache of parsed objects (content streams, fonts),
+            # which otherwise grows with every page
+            reader.resolved_objects.clear()
+            yield text
+
+def extractPdfText(filename, outfile, workers=1):
+    # Write each page as soon as it is extracted; memory use does not grow with the page count.
+    # The output is the same as joining all pages with "\n".
     with open(outfile, 'w') as file:
-        file.write(full_text)
+        for page_num, text in enumerate(iterPdfText(filename, workers)):
+            if page_num > 0:
+                file.write("\n")
+            file.write(text)
+
+def extractPdfFile(filename, outfile):
+    # Extract one PDF of a batch; write to a temporary file first, so an interrupted
+    # extraction never leaves an output that looks up to date
+    out_dir = os.path.dirname(outfile)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    extractPdfText(filename, outfile + '.part')
+    os.replace(outfile + '.part', outfile)
+
+def findPdfFiles(in_path):
+    # Find the PDFs of a directory tree or glob pattern, and the directory their paths are relative to
+    if os.path.isdir(in_path):
+        pdf_files = [os.path.join(root, name) for root, _, files in os.walk(in_path)
+                     for name in files if name.lower().endswith('.pdf')]
+        return pdf_files, in_path
+    pdf_files = [path for path in glob.glob(in_path, recursive=True)
+                 if path.lower().endswith('.pdf') and os.path.isfile(path)]
+    base_dir = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in pdf_files]) if pdf_files else ''
+    return pdf_files, base_dir
+
+def extractPdfBatch(in_path, out_dir=None, workers=1):
+    # Extract every PDF of a directory tree or glob pattern with a pool of worker processes.
+    # Outputs go next to the PDFs, or under out_dir with the same relative paths.
+    # PDFs whose output is newer than the PDF itself are skipped.
+    pdf_files, base_dir = findPdfFiles(in_path)
+    jobs = []
+    for pdf_file in pdf_files:
+        if out_dir:
+            rel_path = os.path.relpath(os.path.abspath(pdf_file), os.path.abspath(base_dir))
+            txt_file = os.path.join(out_dir, os.path.splitext(rel_path)[0] + '.txt')
+        else:
+            txt_file = os.path.splitext(pdf_file)[0] + '.txt'
+        if os.path.exists(txt_file) and os.path.getmtime(txt_file) >= os.path.getmtime(pdf_file):
+            continue
+        jobs.append((pdf_file, txt_file))
+    print(f"{len(jobs)} of {len(pdf_files)} PDFs to extract")
+
+    # Largest files first: idle workers take the next job from the pool's queue,
+    # so the long jobs start early and small ones fill the gaps at the end
+    jobs.sort(key=lambda job: os.path.getsize(job[0]), reverse=True)
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(extractPdfFile, pdf_file, txt_file): pdf_file for pdf_file, txt_file in jobs}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                future.result()
+                print(f"[{done}/{len(jobs)}] {futures[future]}")
+            except Exception as e:
+                failed += 1
+                print(f"[{done}/{len(jobs)}] Error: {futures[future]}: {e}")
+    if failed:
+        print(f"{failed} PDFs failed")
 
 
 def main():
@@ -39,15 +137,25 @@ def main():
     parser.add_argument('in_path',
                         metavar='path',
                         type=str,
-                        help='input file path')
+                        help='input file path, directory or glob pattern (e.g. "papers/**/*.pdf")')
     # optional argument: output path
     parser.add_argument('-o',
                         '--out_path',
                         type=str,
-                        help='output path')
+                        help='output path (output directory for a directory or glob pattern)')
+    # optional argument: number of worker processes
+    parser.add_argument('-j',
+                        '--workers',
+                        type=int,
+                        default=1,
+                        help='number of processes extracting pages (or files, in batch mode) in parallel')
     args = parser.parse_args()
 
-    extractPdfText(args.in_path, args.out_path)
+    if os.path.isfile(args.in_path):
+        out_path = args.out_path if args.out_path else os.path.splitext(args.in_path)[0] + '.txt'
+        extractPdfText(args.in_path, out_path, args.workers)
+    else:
+        extractPdfBatch(args.in_path, args.out_path, args.workers)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
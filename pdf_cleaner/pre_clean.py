@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Deterministic pre-cleaning of text extracted from academic paper PDFs.
+
+Removes the noise that PDF extraction leaves in every page before the text is chunked and
+sent to GPT, so that no tokens are paid for it:
+- Page numbers (a standalone number, counting up page by page)
+- Running headers and footers (the same line at the top or bottom of most pages; digits,
+  e.g. page numbers inside a header, are ignored when comparing)
+- Margin line numbers (long runs of lines starting with consecutive numbers; short runs,
+  such as the index column of a table, are kept)
+- Hyphenated line breaks ("compu-\\ntation" -> "computation"), when the joined word appears
+  unbroken elsewhere in the document; compound words ("well-\\nknown", "state-of-the-\\nart")
+  and words never seen whole are left for the model
+
+Everything that is not recognised with certainty is left for the model to clean.
+
+looks_clean() tells whether a chunk has any extraction artifacts left at all (stray
+numbers, ligature glyphs, broken hyphenation, garbage characters); chunks that do not
+need not be sent to the model.
+
+Usage:
+    python pre_clean.py input.txt output.txt
+"""
+
+import argparse
+import bisect
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+PAGE_NUMBER_RE = re.compile(r'^\s*(?:page\s+)?(\d{1,4})(?:\s+of\s+\d{1,4})?\s*$', re.IGNORECASE)
+LINE_NUMBER_RE = re.compile(r'^(\d{1,5})\s+(?=\S)')
+# A whole word fragment, not preceded by a hyphen (or a digit), broken at the end of a line
+HYPHENATION_RE = re.compile(r'(?<![\w-])([A-Za-z]+)-\n([a-z]+)')
+WORD_RE = re.compile(r'[A-Za-z]+')
+LIGATURE_RE = re.compile('[\ufb00-\ufb06]')
+# Replacement and private-use characters, control characters, UTF-8 decoded as Latin-1/cp1252
+GARBAGE_RE = re.compile('[\ufffd\ue000-\uf8ff\x00-\x08\x0b\x0c\x0e-\x1f]|\u00c3[\x80-\xbf]|\u00e2\u20ac')
+BROKEN_HYPHEN_RE = re.compile(r'[a-z]-\n[a-z]|[a-z]- [a-z]')
+
+MIN_PAGE_LINES = 10     # page numbers are at least this many lines apart
+MIN_CHAIN = 3           # page numbers / line numbers needed in a row to be recognised
+EDGE_LINES = 2          # lines at the top and bottom of a page checked for running headers/footers
+MIN_RUNNING_SHARE = 0.5 # share of pages a running header/footer must appear on
+MAX_LINE_NUMBER_GAP = 2 # unnumbered lines allowed between two numbered lines of a run
+MIN_LINE_NUMBER_RUN = 10 # line numbers needed in a row to be recognised as margin line numbers
+WARMUP_PAGES = 8        # pages buffered by iter_pre_clean_pages to learn the running headers/footers
+MAX_CLEAN_DENSITY = 0.2 # artifacts per 1000 characters up to which a chunk counts as clean
+
+def _normalize(line: str) -> str:
+    return re.sub(r'\d+', '#', line.strip())
+
+def find_page_number_lines(lines: List[str]) -> Set[int]:
+    """Indices of the lines that are page numbers: standalone numbers counting up 1 by 1, a page apart."""
+    positions = defaultdict(list)  # number -> indices of the lines holding it alone, in order
+    candidates = []
+    for i, line in enumerate(lines):
+        match = PAGE_NUMBER_RE.match(line)
+        if match:
+            candidates.append((i, int(match.group(1))))
+            positions[int(match.group(1))].append(i)
+
+    # Chain each candidate to the first one that continues the count a page further on. A chain
+    # started later from a visited candidate would only repeat the rest of the chain it was visited
+    # in, so every candidate is visited once.
+    page_numbers = set()
+    visited = set()
+    for i, number in candidates:
+        if i in visited:
+            continue
+        chain = [i]
+        last_i, last_number = i, number
+        while True:
+            following = positions.get(last_number + 1, [])
+            k = bisect.bisect_left(following, last_i + MIN_PAGE_LINES)
+            if k == len(following):
+                break
+            last_i, last_number = following[k], last_number + 1
+            chain.append(last_i)
+        visited.update(chain)
+        if len(chain) >= MIN_CHAIN:
+            page_numbers.update(chain)
+    return page_numbers
+
+def find_running_lines(pages: List[List[str]]) -> Set[str]:
+    """Normalized lines found at the top or bottom of at least half of the pages (and of 3 or more)."""
+    counts = Counter()
+    for page in pages:
+        content = [line for line in page if line.strip()]
+        edges = {_normalize(line) for line in content[:EDGE_LINES] + content[-EDGE_LINES:]}
+        counts.update(edges)
+    min_count = max(MIN_CHAIN, MIN_RUNNING_SHARE * len(pages))
+    # At least a few letters, so that equation numbers and stray symbols are never taken for headers
+    return {line for line, count in counts.items()
+            if count >= min_count and sum(ch.isalpha() for ch in line) >= 4}
+
+def _edge_numbers(page: List[str]) -> Dict[int, int]:
+    """Standalone numbers among the top and bottom lines of a page, by line index."""
+    content = [i for i, line in enumerate(page) if line.strip()]
+    numbers = {}
+    for i in content[:EDGE_LINES] + content[-EDGE_LINES:]:
+        match = PAGE_NUMBER_RE.match(page[i])
+        if match:
+            numbers[i] = int(match.group(1))
+    return numbers
+
+def find_page_count_lines(pages: List[List[str]],
+                          expected: Optional[int] = None) -> Tuple[List[Set[int]], Optional[int]]:
+    """Find the page numbers of text that is already split into pages.
+
+    A standalone number on the top or bottom lines of a page is its page number if it continues
+    the count: the page before or after has the number before or after it on its edge lines, or
+    it is the number `expected` on the page (the number of the last page found, plus the pages since).
+    Returns, for every page, the indices of its page-number lines, and the number expected on the
+    next page (None while no page number has been found).
+    """
+    edge_numbers = [_edge_numbers(page) for page in pages]
+    page_numbers = []
+    for p, numbers in enumerate(edge_numbers):
+        before = set(edge_numbers[p - 1].values()) if p > 0 else set()
+        after = set(edge_numbers[p + 1].values()) if p + 1 < len(pages) else set()
+        found = {i: number for i, number in numbers.items()
+                 if number == expected or number - 1 in before or number + 1 in after}
+        page_numbers.append(set(found))
+        if found:
+            expected = max(found.values()) + 1
+        elif expected is not None:
+            expected += 1
+    return page_numbers, expected
+
+def strip_running_lines(page: List[str], running: Set[str], page_numbers: Set[int] = frozenset()) -> List[str]:
+    """Remove running headers/footers from the top and bottom lines of a page, and its page-number lines."""
+    content = [i for i, line in enumerate(page) if line.strip()]
+    edges = set(content[:EDGE_LINES] + content[-EDGE_LINES:])
+    return [line for i, line in enumerate(page)
+            if i not in page_numbers and (i not in edges or _normalize(line) not in running)]
+
+def strip_line_numbers(lines: List[str]) -> List[str]:
+    """Remove margin line numbers: leading numbers that count up over at least 10 nearby lines."""
+    numbered = []
+    for i, line in enumerate(lines):
+        match = LINE_NUMBER_RE.match(line)
+        if match:
+            numbered.append((i, int(match.group(1))))
+
+    strip = set()
+    run = []
+    for i, number in numbered + [(None, None)]:
+        if run and i is not None and number == run[-1][1] + 1 and i - run[-1][0] <= MAX_LINE_NUMBER_GAP + 1:
+            run.append((i, number))
+            continue
+        if len(run) >= MIN_LINE_NUMBER_RUN:
+            strip.update(k for k, _ in run)
+        run = [(i, number)]
+    return [LINE_NUMBER_RE.sub('', line) if i in strip else line for i, line in enumerate(lines)]
+
+def word_set(text: str) -> Set[str]:
+    """The words of a text, in lower case."""
+    return {word.lower() for word in WORD_RE.findall(text)}
+
+def join_hyphenated(text: str, vocabulary: Optional[Set[str]] = None) -> str:
+    """Join words hyphenated at a line break ("compu-\\ntation" -> "computation").
+
+    Only words found unbroken in `vocabulary` (by default, the words of the text itself) are
+    joined, so that compounds such as "well-\\nknown" are not turned into "wellknown".
+    """
+    if vocabulary is None:
+        vocabulary = word_set(text)
+
+    def join(match):
+        word = match.group(1) + match.group(2)
+        return word if word.lower() in vocabulary else match.group(0)
+    return HYPHENATION_RE.sub(join, text)
+
+def _clean_pages(pages: List[List[str]], running: Set[str], page_numbers: List[Set[int]],
+                 vocabulary: Optional[Set[str]] = None) -> str:
+    lines = [line for page, numbers in zip(pages, page_numbers)
+             for line in strip_running_lines(page, running, numbers)]
+    return join_hyphenated('\n'.join(strip_line_numbers(lines)), vocabulary)
+
+def pre_clean_text(text: str) -> str:
+    """Pre-clean the extracted text of a whole document.
+
+    The page breaks are recovered from the page numbers; without them, only line numbers and
+    hyphenation are handled.
+    """
+    lines = text.split('\n')
+    page_number_lines = find_page_number_lines(lines)
+    breaks = sorted(page_number_lines)
+    if not breaks:
+        return join_hyphenated('\n'.join(strip_line_numbers(lines)))
+
+    # A page number ends its page unless it is the first line of one (nothing but blank lines above)
+    bounds = [0]
+    for i in breaks:
+        before = [line for line in lines[bounds[-1]:i] if line.strip()]
+        bounds.append(i if not before else i + 1)
+    bounds.append(len(lines))
+    pages = [lines[start:stop] for start, stop in zip(bounds, bounds[1:])]
+    # Only the chained page numbers are removed, not every number on the edge of a page
+    page_numbers = [{i - start for i in breaks if start <= i < stop} for start, stop in zip(bounds, bounds[1:])]
+    return _clean_pages(pages, find_running_lines(pages), page_numbers)
+
+def iter_pre_clean_pages(pages: Iterable[str], warmup: int = WARMUP_PAGES) -> Iterator[str]:
+    """Pre-clean text that arrives page by page (e.g. from iterPdfText), yielding cleaned pages.
+
+    The running headers/footers and the page count are learned from the first `warmup` pages,
+    which are held back until then; every later page is cleaned as soon as it arrives, and loses
+    its page number only if it continues the count (see find_page_count_lines). Pages that come
+    out empty are skipped. Hyphenated words are joined if they appear unbroken on the pages
+    seen so far.
+    """
+    buffered = []
+    running = None
+    expected = None
+    vocabulary = set()
+    for page in pages:
+        vocabulary.update(word_set(page))
+        if running is None:
+            buffered.append(page.split('\n'))
+            if len(buffered) < warmup:
+                continue
+            running = find_running_lines(buffered)
+            pending, buffered = buffered, []
+        else:
+            pending = [page.split('\n')]
+        page_numbers, expected = find_page_count_lines(pending, expected)
+        for lines, numbers in zip(pending, page_numbers):
+            cleaned = _clean_pages([lines], running, [numbers], vocabulary)
+            if cleaned.strip():
+                yield cleaned
+    if buffered:
+        running = find_running_lines(buffered)
+        page_numbers, _ = find_page_count_lines(buffered)
+        for lines, numbers in zip(buffered, page_numbers):
+            cleaned = _clean_pages([lines], running, [numbers], vocabulary)
+            if cleaned.strip():
+                yield cleaned
+
+def count_artifacts(text: str) -> int:
+    """Count the extraction artifacts in a text: stray page/line numbers, ligatures, broken hyphenation, garbage."""
+    lines = text.split('\n')
+    stray_numbers = sum(1 for line, stripped in zip(lines, strip_line_numbers(lines)) if line != stripped)
+    stray_numbers += sum(1 for line in lines if PAGE_NUMBER_RE.match(line))
+    return (stray_numbers + len(LIGATURE_RE.findall(text)) + len(GARBAGE_RE.findall(text))
+            + len(BROKEN_HYPHEN_RE.findall(text)))
+
+def artifact_density(text: str) -> float:
+    """Extraction artifacts per 1000 characters."""
+    return 1000 * count_artifacts(text) / max(len(text), 1)
+
+def looks_clean(text: str, max_density: float = MAX_CLEAN_DENSITY) -> bool:
+    """Whether a chunk is clean enough to be used as is, without sending it to the model."""
+    return artifact_density(text) <= max_density
+
+def main():
+    parser = argparse.ArgumentParser(description='Remove page numbers, running headers/footers, line numbers '
+                                                 'and hyphenation from extracted paper text')
+    parser.add_argument('input_file', help='Path to the input text file')
+    parser.add_argument('output_file', help='Path to save the pre-cleaned text')
+    args = parser.parse_args()
+
+    with open(args.input_file, 'r', encoding='utf-8') as f:
+        text = f.read()
+    cleaned = pre_clean_text(text)
+    with open(args.output_file, 'w', encoding='utf-8') as f:
+        f.write(cleaned)
+    print(f"Pre-cleaned text saved to {args.output_file} ({len(text)} -> {len(cleaned)} characters)")
+
+if __name__ == "__main__":
+    main()